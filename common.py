@@ -1,8 +1,10 @@
+import multiprocessing
 import os
 import re
 import stat
 import subprocess
 import sys
+import threading
 
 from collections import defaultdict
 from textwrap import dedent
@@ -194,22 +196,52 @@ def is_device(dev):
     mode = os.stat(dev)[stat.ST_MODE]
     return not (not mode & stat.S_IFCHR)
 
-__logged = []
+# Ids already logged by this process
+__logged = set()
+# Queue to a LogListener, in pool workers
+__log_queue = None
 
-def set_logged_list(logged):
-    global __logged
-    __logged = logged
+def set_log_queue(queue):
+    '''Send messages of log_once in this (pool worker) process through
+    @queue, to be written by the LogListener of the parent process.'''
+    global __logged, __log_queue
+    __logged = set()
+    __log_queue = queue
 
 def log_once(id, msg = None, indent = True):
-    global __logged
+    if id in __logged:
+        return
+    __logged.add(id)
 
     msg = msg if msg else id
 
-    if id not in  __logged:
-        __logged += [id]
-        if indent:
-            msg = '   ' + msg.strip('\t').replace('\n', '\n\t')
-        sys.stderr.write('\n' + msg.strip('\n') + '\n')
+    # Other workers may log the same id, so the listener checks it again
+    if __log_queue is not None:
+        __log_queue.put((id, msg, indent))
+        return
+
+    if indent:
+        msg = '   ' + msg.strip('\t').replace('\n', '\n\t')
+    sys.stderr.write('\n' + msg.strip('\n') + '\n')
+
+class LogListener(object):
+    '''Write messages logged by pool workers through log_once, each only
+    once, from a thread of this process. Workers must be initialized with
+    set_log_queue(listener.queue).'''
+    def __init__(self):
+        self.queue  = multiprocessing.Queue()
+        self.thread = threading.Thread(target=self.__listen)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __listen(self):
+        for id, msg, indent in iter(self.queue.get, None):
+            log_once(id, msg, indent)
+
+    def stop(self):
+        '''Write every message sent so far and stop listening.'''
+        self.queue.put(None)
+        self.thread.join()
 
 def get_cmd():
     return os.path.split(sys.argv[0])[1]
@@ -63,14 +63,127 @@ OVH_ALL_EVENTS  += ['RELEASE_LATENCY']
 # This event doesn't have a START and END
 OVH_BASE_EVENTS += ['RELEASE_LATENCY']
 
+# Feather-trace ids of the START record of overhead events, whose END
+# record has the next id, or of single events. These are decoded directly
+# from the trace; other events are extracted with ft2csv
+OVH_EVENT_IDS = {'SCHED'          : 100,
+                 'SCHED2'         : 102,
+                 'CXS'            : 104,
+                 'RELEASE'        : 106,
+                 'TICK'           : 110,
+                 'PLUGIN_SCHED'   : 120,
+                 'RELEASE_LATENCY': 208}
+OVH_SINGLE_EVENTS = ['RELEASE_LATENCY']
+# Sort feather-trace records by sequence number in memory instead of
+# copying the trace and running ftsort. The order is cached in each
+# experiment's tmp/cache directory. A sorted copy is still written for
+# ft2csv, and removed again, whenever OVH_BASE_EVENTS lists events without
+# OVH_EVENT_IDS (LOCK, UNLOCK and TREE by default) and the trace holds
+# records of events other than those in OVH_EVENT_IDS
+OVH_NATIVE_SORT = True
+# Also write the average and maximum of each decoded overhead per CPU and
+# over OVH_TIME_BUCKETS slices of the run into tmp/overheads, which
+# plot_exps.py can plot
+OVH_BREAKDOWN = True
+OVH_TIME_BUCKETS = 500
+
 BEST_EFFORT_LIST = ['PLUGIN_SCHED', 'TREE']
 #CUMULATIVE_OVERHEAD_LIST = ['SCHED', 'RELEASE', 'SCHED2', 'TICK', 'CXS', 'TREE']
 CUMULATIVE_OVERHEAD_LIST = ['PLUGIN_SCHED', 'RELEASE', 'TREE']
 PREEMPTION_THRESHOLD = 40000
 PERCENTILE_FILTER_ENABLED = True
 PERCENTILE = 99.9
+# How overhead statistics are computed. 'sort' sorts every overhead and
+# reproduces earlier results exactly. 'select' finds percentiles by
+# partial sorting (selection) in linear time, which is faster, but sums
+# filtered overheads in another order, so Avg and Var may differ from
+# 'sort' in their last float32 digits
+OVH_STATS_ENGINE = 'sort'
+# Percentiles of each overhead, before filtering, stored as <event>-p<n>,
+# e.g. [50, 99, 99.9, 99.99]
+OVH_PERCENTILES = []
 #AXES X,Y BOUNDS
 
 # If a task is missing more than this many records, its measurements
 # are not included in sched_trace summaries
 MAX_RECORD_LOSS = .2
+
+# Read sched_trace files through a read-only memory map, this many records
+# at a time, instead of issuing a read() for every record
+SCHED_MMAP = True
+SCHED_CHUNK_RECORDS = 1 << 16
+
+# How per-CPU sched_trace files are merged into time order. 'window' keeps
+# a window of upcoming records from each file in a heap; 'sort' sorts all
+# records at once, which also orders arbitrarily late records exactly
+SCHED_MERGE = 'window'
+# The 'window' merge holds back records until every file has been read as
+# far past them as the largest jump back in time within a file so far, but
+# never more than this many records (a few hundred bytes each). Jumps are
+# measured as files are read, a chunk of SCHED_CHUNK_RECORDS ahead with
+# SCHED_MMAP. Records left out of order, by this limit or by a jump seen
+# too late, are counted and reported
+SCHED_MAX_QUEUED = 1 << 20
+
+# Process sched_trace records one event type at a time, as NumPy arrays,
+# after sorting them as with SCHED_MERGE = 'sort'. This is the fastest
+# path, but every kept record of every sched_trace file is held in memory
+# at once, with its sort keys: a peak of about 4 times the size of the
+# files. Set to False with SCHED_MERGE = 'window' to bound memory by
+# SCHED_MAX_QUEUED instead
+SCHED_COLUMNAR = True
+# Cache sorted records in each experiment's tmp/cache directory so that
+# unchanged sched_trace files are not decoded again
+SCHED_CACHE = True
+# Write a table of per-job sched_trace data into each experiment's tmp dir
+SCHED_JOB_TABLE = True
+# Also write sched_trace statistics over windows of this many ms into
+# tmp/windows, which plot_exps.py can plot. 0 disables it. Windows are
+# summed while records are processed, on every parse path, so they only
+# take memory per window
+SCHED_WINDOW_MS = 1000
+# Decode per-CPU sched_trace files in parallel once they add up to this
+# many bytes (and more than one processor is available)
+SCHED_PARALLEL_BYTES = 64 << 20
+# Records per time block in the sched_trace index used by task_records()
+# and time_records(). Smaller blocks find time ranges more precisely
+SCHED_INDEX_BLOCK = 4096
+
+# Keep every sched_trace duration (e.g. tardiness) in memory for exact
+# percentiles. Otherwise a sketch is kept whose percentiles are within
+# SKETCH_ACCURACY (relative error) of the true values
+SCHED_EXACT_DURATIONS = False
+SKETCH_ACCURACY = .01
+
+# Quick-look parsing (parse_exps.py -q) reads sched_trace files in this
+# many equal time slots, of which a random fraction is sampled. Slots are
+# found through the time of every SCHED_SAMPLE_STEP-th record, and read on
+# for this many ms so that jobs released late in a slot can complete
+SCHED_SAMPLE_SLOTS = 20
+SCHED_SAMPLE_STEP = 1024
+SCHED_SAMPLE_MARGIN_MS = 100
+
+# Estimated seconds to parse an experiment: PARSE_COST_BASE plus these many
+# per byte of feather-trace (FT) and sched_trace (ST) files. parse_exps.py
+# parses the most expensive experiments first and, with --costs, writes the
+# estimates next to the actual times so that these can be tuned
+PARSE_COST_BASE = .02
+PARSE_COST_FT = 1e-7
+PARSE_COST_ST = 1e-7
+
+# Settings which change parse_exps.py results, including the files it
+# writes into tmp/. Experiments are parsed again, without -f, whenever one
+# of these or an input file changes. Settings which only change how fast
+# or in how much memory data is parsed (e.g. SCHED_MMAP, SCHED_CACHE,
+# OVH_NATIVE_SORT) are left out
+PARSE_SETTINGS = ['FILES', 'PARAMS', 'DEFAULTS',
+                  'OVH_BASE_EVENTS', 'OVH_EVENT_IDS', 'OVH_SINGLE_EVENTS',
+                  'BEST_EFFORT_LIST', 'CUMULATIVE_OVERHEAD_LIST',
+                  'PREEMPTION_THRESHOLD', 'PERCENTILE_FILTER_ENABLED',
+                  'PERCENTILE', 'OVH_STATS_ENGINE', 'OVH_PERCENTILES',
+                  'OVH_BREAKDOWN', 'OVH_TIME_BUCKETS', 'MAX_RECORD_LOSS',
+                  'SCHED_MERGE', 'SCHED_MAX_QUEUED', 'SCHED_COLUMNAR',
+                  'SCHED_JOB_TABLE', 'SCHED_WINDOW_MS',
+                  'SCHED_EXACT_DURATIONS', 'SKETCH_ACCURACY',
+                  'SCHED_SAMPLE_SLOTS', 'SCHED_SAMPLE_STEP',
+                  'SCHED_SAMPLE_MARGIN_MS']
@@ -0,0 +1,84 @@
+import hashlib
+import numpy as np
+import os
+import shutil as sh
+import zipfile
+
+# Directory under an experiment's work dir which survives forced re-parses
+CACHE_DIR = "cache"
+
+# Bytes hashed from the start, middle and end of a file by file_key
+SAMPLE_BYTES = 1 << 16
+
+def file_key(fname):
+    '''Identify the contents of @fname by its size, modification time and
+    a hash of a few blocks, without reading the whole file.'''
+    stat = os.stat(fname)
+    sha  = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for offset in (0, stat.st_size / 2, stat.st_size - SAMPLE_BYTES):
+            f.seek(max(offset, 0))
+            sha.update(f.read(SAMPLE_BYTES))
+    return "%d:%r:%s" % (stat.st_size, stat.st_mtime, sha.hexdigest())
+
+def dir_key(path):
+    '''Identify the files directly in @path, but not those in directories
+    below it, by their names and file_key, one per line.'''
+    keys = []
+    for name in sorted(os.listdir(path)):
+        fname = "%s/%s" % (path, name)
+        if os.path.isfile(fname):
+            keys += ["%s %s" % (name, file_key(fname))]
+    return "\n".join(keys)
+
+def cache_dir(work_dir):
+    '''Return (and create) the cache directory in @work_dir.'''
+    path = "%s/%s" % (work_dir, CACHE_DIR)
+    if not os.path.exists(path):
+        os.mkdir(path)
+    return path
+
+def clean_work_dir(work_dir):
+    '''Remove everything in @work_dir except cached data.'''
+    for name in os.listdir(work_dir):
+        if name == CACHE_DIR:
+            continue
+        path = "%s/%s" % (work_dir, name)
+        if os.path.isdir(path):
+            sh.rmtree(path)
+        else:
+            os.remove(path)
+
+def save_arrays(fname, key, arrays):
+    '''Store map of names to @arrays compressed in @fname, under @key.'''
+    tmp_name = fname + ".tmp.npz"
+    np.savez_compressed(tmp_name, __key__=np.array(key), **arrays)
+    # Never leave a partial file behind under the real name
+    os.rename(tmp_name, fname)
+
+def load_arrays(fname, key):
+    '''Return the map of arrays stored in @fname if it was stored under
+    @key, otherwise None.'''
+    if not os.path.exists(fname):
+        return None
+    try:
+        with np.load(fname) as data:
+            if str(data['__key__']) != key:
+                return None
+            return dict((name, data[name]) for name in data.files
+                        if name != '__key__')
+    except (IOError, KeyError, ValueError, zipfile.BadZipfile):
+        return None
+
+def is_cached(fname, key):
+    '''Return True if @fname was stored by mark_cached under @key.'''
+    try:
+        with open(fname + ".key") as f:
+            return os.path.exists(fname) and f.read() == key
+    except IOError:
+        return False
+
+def mark_cached(fname, key):
+    '''Record that @fname, once completely written, belongs to @key.'''
+    with open(fname + ".key", 'w') as f:
+        f.write(key)
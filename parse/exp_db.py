@@ -0,0 +1,144 @@
+import itertools
+import numpy as np
+import os
+import sqlite3
+
+from point import ExpPoint,Measurement
+
+# Type of measurement values which are Python longs
+LONG_TYPE = "long"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS experiments (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    key  TEXT
+);
+CREATE TABLE IF NOT EXISTS params (
+    path  TEXT,
+    name  TEXT,
+    value TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    path  TEXT,
+    stat  TEXT,
+    type  TEXT,
+    value,
+    dtype TEXT,
+    PRIMARY KEY (path, stat, type)
+);
+CREATE INDEX IF NOT EXISTS params_by_name ON params (name, value);
+CREATE INDEX IF NOT EXISTS measurements_by_stat ON measurements (stat);
+'''
+
+class ExpDB(object):
+    '''Index of parsed experiments in a SQLite database: the params of
+    each experiment directory and the values of each of its measurements.
+    Tables can be built from it without reading experiment directories.
+    Only the values of measurements are kept, not sketches.'''
+    def __init__(self, fname):
+        self.conn = sqlite3.connect(fname)
+        # Names are used as plain strs, like those parsed from files
+        self.conn.text_factory = str
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __where(self, dirs):
+        '''Return an SQL condition, and its arguments, selecting the
+        experiments in or below any of @dirs (all if None).'''
+        if dirs is None:
+            return "1", []
+
+        clauses, args = [], []
+        for d in dirs:
+            d = os.path.abspath(d)
+            # Paths below d sort between d/ and d0, as '0' follows '/'
+            clauses += ["path = ? OR (path >= ? AND path < ?)"]
+            args += [d, d + "/", d + "0"]
+        return "(%s)" % " OR ".join(clauses or ["0"]), args
+
+    def get_key(self, path):
+        '''Return the key @path was stored under, or None.'''
+        row = self.conn.execute("SELECT key FROM experiments WHERE path = ?",
+                                (os.path.abspath(path),)).fetchone()
+        return row[0] if row else None
+
+    def store(self, path, params, key, point):
+        '''Replace the @params and ExpPoint @point of experiment @path,
+        parsed from inputs identified by @key.'''
+        path = os.path.abspath(path)
+
+        rows = []
+        for stat, measurement in point:
+            for type, value in measurement:
+                # NumPy values and longs are stored with their type, so
+                # they are loaded (and printed) exactly as they were parsed
+                dtype = None
+                if isinstance(value, np.generic):
+                    dtype = value.dtype.name
+                    value = value.item()
+                elif isinstance(value, long):
+                    dtype = LONG_TYPE
+                rows += [(path, stat, type, value, dtype)]
+
+        with self.conn:
+            for table in ("experiments", "params", "measurements"):
+                self.conn.execute("DELETE FROM %s WHERE path = ?" % table,
+                                  (path,))
+            self.conn.execute("INSERT INTO experiments VALUES (?, ?, ?)",
+                              (path, point.id, key))
+            self.conn.executemany("INSERT INTO params VALUES (?, ?, ?)",
+                                  [(path, k, repr(v))
+                                   for k, v in params.iteritems()])
+            self.conn.executemany("INSERT INTO measurements "
+                                  "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def load(self, dirs = None):
+        '''Yield (path, params, ExpPoint) of each experiment in or below
+        any of @dirs, or of every experiment if None.'''
+        where, args = self.__where(dirs)
+
+        def rows(query):
+            cursor = self.conn.execute(query % where + " ORDER BY path", args)
+            return itertools.groupby(cursor, lambda row: row[0])
+
+        exps   = self.conn.execute("SELECT path, name FROM experiments "
+                                   "WHERE %s ORDER BY path" % where, args)
+        params = rows("SELECT path, name, value FROM params WHERE %s")
+        values = rows("SELECT path, stat, type, value, dtype "
+                      "FROM measurements WHERE %s")
+
+        # All three are ordered by path, so walk them together
+        next_params = next(params, (None, None))
+        next_values = next(values, (None, None))
+
+        for path, name in exps:
+            kv = {}
+            while next_params[0] is not None and next_params[0] <= path:
+                if next_params[0] == path:
+                    kv = dict((k, eval(v)) for _, k, v in next_params[1])
+                next_params = next(params, (None, None))
+
+            point = ExpPoint(name)
+            while next_values[0] is not None and next_values[0] <= path:
+                if next_values[0] == path:
+                    for _, stat, type, value, dtype in next_values[1]:
+                        if stat not in point:
+                            point[stat] = Measurement(stat)
+                        if dtype == LONG_TYPE:
+                            value = long(value)
+                        elif dtype:
+                            value = np.dtype(dtype).type(value)
+                        point[stat][type] = value
+                next_values = next(values, (None, None))
+
+            yield path, kv, point
@@ -1,4 +1,6 @@
+import cache
 import config.config as conf
+import itertools
 import numpy as np
 import os
 import re
@@ -6,62 +8,267 @@ import shutil as sh
 import sys
 import subprocess
 
+from collections import namedtuple
+from dir_map import DirMap
+from multiprocessing.pool import ThreadPool
 from point import Measurement,Type
 
-FT_SPLIT_NAME  = "overhead={}.bin"
 FT_SORTED_NAME = "sorted-ft.bin"
+FT_ORDER_NAME  = "ft-order.npz"
+# Per-CPU and per-time overheads, written as a directory plot_exps.py can plot
+FT_BREAKDOWN_DIR = "overheads"
 FT_ERR_NAME    = "err-ft"
 
-def parse_overhead(result, overhead_bin, overhead, cycles, out_dir, err_file):
-    '''Store statistics for @overhead in @overhead_bin into @result.'''
-    ovh_fname = "{}/{}".format(out_dir, FT_SPLIT_NAME).format(overhead)
+# A feather-trace timestamp record. 'stamp' holds the 48-bit time stamp
+# (cycles) under the 16-bit pid, 'flags' the 2-bit task type under the
+# irq flag and count
+FT_DTYPE = np.dtype([('stamp', '<u8'), ('seq_no', '<u4'), ('cpu', 'u1'),
+                     ('event', 'u1'), ('flags', 'u1'), ('unused', 'u1')])
+FT_STAMP_MASK = (1 << 48) - 1
+# Task type of a record taken while a real-time task was running
+FT_TSK_RT = 1
+# Set in 'flags' if an interrupt occurred while the record was taken
+FT_IRQ_FLAG = 1 << 2
 
-    if os.path.exists(ovh_fname):
-        os.remove(ovh_fname)
-    ovh_file = open(ovh_fname, 'w')
-    
+# Durations (cycles) of an event with the CPU and time stamp (cycles) of
+# each. Single events have no time stamp apart from their value
+FtPairs = namedtuple('FtPairs', ['durations', 'cpus', 'times'])
+
+def add_moments(m, data):
+    # Same as np.mean, without summing twice
+    total = np.sum(data)
+
+    m[Type.Avg] = total.dtype.type(total / len(data))
+    m[Type.Var] = np.var(data)
+    m[Type.Sum] = long(total)
+
+def overhead_stats(name, data, percentiles = []):
+    '''Return a Measurement of sorted overhead @data and the values of
+    its @percentiles.'''
+    m = Measurement(name)
+    values = np.percentile(data, percentiles) if len(percentiles) else []
+
+    #Percentile filtering
+    if conf.PERCENTILE_FILTER_ENABLED:
+        percentile = np.percentile(data, conf.PERCENTILE)
+        data = data[:np.searchsorted(data, percentile, 'right')]
+
+    m[Type.Max] = data[-1]
+    m[Type.Min] = data[0]
+    add_moments(m, data)
+    return m, values
+
+def select_stats(name, data, percentiles = [], overwrite = False):
+    '''Return the same as overhead_stats for unsorted overhead @data,
+    selecting percentiles instead of sorting. @data is only reordered if
+    @overwrite, otherwise it may be read-only (e.g. memory mapped).'''
+    m = Measurement(name)
+
+    wanted = list(percentiles)
+    if conf.PERCENTILE_FILTER_ENABLED:
+        wanted.append(conf.PERCENTILE)
+
+    # A single partition finds every percentile at once
+    values = []
+    if wanted:
+        values = np.percentile(data, wanted, overwrite_input=overwrite)
+
+    m[Type.Min] = data.min()
+    if conf.PERCENTILE_FILTER_ENABLED:
+        data = data[data <= values[-1]]
+    m[Type.Max] = data.max()
+    add_moments(m, data)
+    return m, values[:len(percentiles)]
+
+def store_overhead(result, overhead_bin, overhead, data, cycles):
+    '''Store statistics of @overhead, in float32 cycles @data, into @result.
+    Each of OVH_PERCENTILES is stored as a separate overhead.'''
+    data /= float(cycles) # Scale for processor speed
+    name = "%s-%s" % (overhead_bin, overhead)
+
+    if conf.OVH_STATS_ENGINE == 'sort':
+        data.sort()
+        m, values = overhead_stats(name, data, conf.OVH_PERCENTILES)
+    else:
+        m, values = select_stats(name, data, conf.OVH_PERCENTILES, True)
+
+    result[overhead] = m
+    for percentile, value in zip(conf.OVH_PERCENTILES, values):
+        pname = "%s-p%g" % (overhead, percentile)
+        result[pname] = Measurement("%s-p%g" % (name, percentile))\
+                        .from_array([value])
+
+def split_overhead(overhead_bin, overhead, out_dir, err_file):
+    '''Return the float32 array of @overhead durations (cycles) which
+    ft2csv extracts from @overhead_bin.'''
     if overhead in conf.BEST_EFFORT_LIST:
         cmd  = [conf.BINS["ftsplit"], "-r", "-b", overhead, overhead_bin]
     else:
         cmd  = [conf.BINS["ftsplit"], "-r", overhead, overhead_bin]
-    ret  = subprocess.call(cmd, cwd=out_dir, stderr=err_file, stdout=ovh_file)
-    size = os.stat(ovh_fname).st_size
+
+    # Read durations straight from the pipe instead of a temporary file
+    proc = subprocess.Popen(cmd, cwd=out_dir, stderr=err_file,
+                            stdout=subprocess.PIPE)
+    data = proc.stdout.read()
+    ret  = proc.wait()
 
     if ret:
         raise Exception("Failed (%d) with command: %s" % (ret, " ".join(cmd)))
-    if not size:
-        os.remove(ovh_fname)
-    if size and not ret:
-        # Map and sort file for stats
-        data = np.memmap(ovh_fname, dtype="float32", mode='c')
-        data /= float(cycles) # Scale for processor speed
-        data.sort()
+    return np.frombuffer(data, dtype=np.float32).copy()
+
+def split_overheads(overhead_bin, overheads, out_dir, err_file, procs = 1):
+    '''Yield (overhead, durations) of each of @overheads, extracted by up
+    to @procs ft2csv processes at once, in the order they finish.'''
+    procs = min(procs, len(overheads))
+    if procs <= 1:
+        for overhead in overheads:
+            yield overhead, split_overhead(overhead_bin, overhead,
+                                           out_dir, err_file)
+        return
+
+    def split(overhead):
+        return overhead, split_overhead(overhead_bin, overhead,
+                                        out_dir, err_file)
+
+    # Threads only wait on the ft2csv processes
+    pool = ThreadPool(procs)
+    try:
+        for result in pool.imap_unordered(split, overheads):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def decode_overheads(records, order, overheads):
+    '''Return a map of each of @overheads, which must be in OVH_EVENT_IDS,
+    to the FtPairs of its float32 durations (cycles) in FT_DTYPE @records
+    (e.g. memory mapped) taken in sequence number @order, or as they are
+    if @order is None. This pairs records like ft2csv, one event at a
+    time, only copying the records of that event: a START record is paired
+    with the next END record of its CPU, unless another START comes first.
+    Pairs spanning lost records, going back in time, interrupted (either
+    record has the irq flag set) or, unless in BEST_EFFORT_LIST, with no
+    real-time task involved are dropped. Single events, like
+    RELEASE_LATENCY, hold their value in the time stamp and are dropped
+    if interrupted too.'''
+    def in_order(column):
+        return column if order is None else column[order]
+
+    if not len(records):
+        none = np.empty(0, dtype=np.float32)
+        return dict((o, FtPairs(none, none, None)) for o in overheads)
+
+    event = in_order(records['event'])
+
+    # Number of gaps in sequence numbers up to each record
+    seq_no = in_order(records['seq_no'])
+    holes  = np.zeros(len(seq_no), dtype=np.uint32)
+    np.cumsum(seq_no[1:] != seq_no[:-1] + 1, out=holes[1:])
+    del seq_no
+
+    pairs = {}
+    for overhead in overheads:
+        start = conf.OVH_EVENT_IDS[overhead]
+        best_effort = overhead in conf.BEST_EFFORT_LIST
 
-        #Percentile filtering
-        if conf.PERCENTILE_FILTER_ENABLED:
-            filtered = list() 
-            percentile = np.percentile(data, conf.PERCENTILE)
-            for e in data:
-                if e <= percentile:
-                    filtered.append(e)
-            filtered.sort()
-            m = Measurement("%s-%s" % (overhead_bin, overhead))
-            m[Type.Max] = filtered[-1]
-            m[Type.Avg] = np.mean(filtered)
-            m[Type.Min] = filtered[0]
-            m[Type.Var] = np.var(filtered)
-            m[Type.Sum] = long(np.sum(filtered))
-		else:
-            m = Measurement("%s-%s" % (overhead_bin, overhead))
-            m[Type.Max] = data[-1]
-            m[Type.Avg] = np.mean(data)
-            m[Type.Min] = data[0]
-            m[Type.Var] = np.var(data)
-            m[Type.Sum] = long(np.sum(data))
-
-        result[overhead] = m
-
-        os.remove(ovh_fname)
+        # Records of the event, in order
+        at = np.flatnonzero((event == start) | (event == start + 1))
+        found = records[at if order is None else order[at]]
+
+        cpu   = found['cpu']
+        stamp = (found['stamp'] & np.uint64(FT_STAMP_MASK)).astype(np.int64)
+        is_rt = (found['flags'] & 3) == FT_TSK_RT
+        irq   = (found['flags'] & FT_IRQ_FLAG).astype(bool)
+
+        if overhead in conf.OVH_SINGLE_EVENTS:
+            keep = (found['event'] == start) & ~irq
+            if not best_effort:
+                keep &= is_rt
+            pairs[overhead] = FtPairs(stamp[keep].astype(np.float32),
+                                      cpu[keep], None)
+            continue
+
+        # Grouped by CPU in order
+        kind  = found['event']
+        group = np.argsort(cpu, kind='mergesort')
+        first, second = group[:-1], group[1:]
+        pair = ((kind[first] == start) & (kind[second] == start + 1) &
+                (cpu[first] == cpu[second]))
+        first, second = first[pair], second[pair]
+
+        length = stamp[second] - stamp[first]
+        keep = (holes[at[first]] == holes[at[second]]) & (length >= 0)
+        # ft2csv leaves out interrupted samples unless run with -a
+        keep &= ~(irq[first] | irq[second])
+        if not best_effort:
+            keep &= is_rt[first] | is_rt[second]
+        pairs[overhead] = FtPairs(length[keep].astype(np.float32),
+                                  cpu[first[keep]], stamp[first[keep]])
+
+    return pairs
+
+def overhead_breakdown(overhead, pairs, cycles, dir_map):
+    '''Add the average and maximum of @overhead's @pairs on each CPU and,
+    if they have time stamps, in each of OVH_TIME_BUCKETS slices of the
+    run (ms) to @dir_map. Values are in the units of the overhead
+    statistics, but not percentile filtered.'''
+    values = pairs.durations / float(cycles)
+
+    def add(variable, group, xs):
+        count = np.bincount(group)
+        avg = np.bincount(group, values) / count.clip(1)
+        top = np.zeros(len(count))
+        np.maximum.at(top, group, values)
+        found = count > 0
+        for line, ys in (("avg", avg), ("max", top)):
+            dir_map.add_values([overhead, variable, line + ".csv"],
+                               zip(xs[found], ys[found]))
+
+    cpus, group = np.unique(pairs.cpus, return_inverse=True)
+    add("cpu", group, cpus)
+
+    if pairs.times is not None and conf.OVH_TIME_BUCKETS:
+        since = pairs.times - pairs.times.min()
+        width = since.max() // conf.OVH_TIME_BUCKETS + 1
+        group = since // width
+        xs = np.arange(group.max() + 1) * (width / float(cycles) / 1000)
+        add("time", group, xs)
+
+def map_ft(ft_file):
+    '''Map feather-trace file @ft_file read-only as an array of FT_DTYPE.'''
+    count = os.path.getsize(ft_file) / FT_DTYPE.itemsize
+    if not count:
+        return np.empty(0, dtype=FT_DTYPE)
+    return np.memmap(ft_file, dtype=FT_DTYPE, mode='r', shape=(count,))
+
+def ft_order(ft_file, work_dir):
+    '''Return the permutation which sorts the records of @ft_file by
+    sequence number, like ftsort. It is cached in @work_dir and only
+    computed again if @ft_file changes.'''
+    order_file = "%s/%s" % (cache.cache_dir(work_dir), FT_ORDER_NAME)
+    key = cache.file_key(ft_file)
+
+    arrays = cache.load_arrays(order_file, key)
+    if arrays is None:
+        order  = np.argsort(map_ft(ft_file)['seq_no'], kind='mergesort')
+        arrays = {'order': order.astype(np.uint32)}
+        cache.save_arrays(order_file, key, arrays)
+    return arrays['order']
+
+def write_sorted_ft(ft_file, order, out_dir):
+    '''Create and return a copy of @ft_file sorted by @order, for ft2csv.'''
+    out_fname = "%s/%s" % (out_dir, FT_SORTED_NAME)
+
+    records = map_ft(ft_file)
+    chunk   = conf.SCHED_CHUNK_RECORDS
+    with open(out_fname, 'wb') as f:
+        for start in xrange(0, len(order), chunk):
+            records[order[start:start + chunk]].tofile(f)
+
+    return out_fname
 
 def sort_ft(ft_file, err_file, out_dir):
     '''Create and return file with sorted overheads from @ft_file.'''
@@ -77,7 +284,19 @@ def sort_ft(ft_file, err_file, out_dir):
 
     return out_fname
 
-def extract_ft_data(result, data_dir, work_dir, cycles):
+def has_unknown_events(records):
+    '''Return True if FT_DTYPE @records hold any event whose id is not
+    one of OVH_EVENT_IDS, which only ft2csv could extract.'''
+    known = set()
+    for event, start in conf.OVH_EVENT_IDS.iteritems():
+        known.add(start)
+        if event not in conf.OVH_SINGLE_EVENTS:
+            known.add(start + 1)
+
+    found = np.flatnonzero(np.bincount(records['event'], minlength=256))
+    return bool(set(found.tolist()) - known)
+
+def extract_ft_data(result, data_dir, work_dir, cycles, procs = 1):
     data_dir = os.path.abspath(data_dir)
     work_dir = os.path.abspath(work_dir)
 
@@ -91,8 +310,58 @@ def extract_ft_data(result, data_dir, work_dir, cycles):
     if not os.path.getsize(bin_file):
         return False
 
+    # Events whose ids are known are decoded here, the rest by ft2csv
+    native = [e for e in conf.OVH_BASE_EVENTS if e in conf.OVH_EVENT_IDS]
+    split  = [e for e in conf.OVH_BASE_EVENTS if e not in native]
+
+    # Measurements are named after the sorted file in the work dir
+    ovh_bin = "{}/{}".format(work_dir, FT_SORTED_NAME)
+
     with open("%s/%s" % (work_dir, FT_ERR_NAME), 'w') as err_file:
-        sorted_bin = sort_ft(bin_file, err_file, work_dir)
+        sorted_bin = None
+        try:
+            if conf.OVH_NATIVE_SORT:
+                records = map_ft(bin_file)
+                # ft2csv would find nothing in a trace of known events only
+                if split and not has_unknown_events(records):
+                    split = []
+
+                # Only the (cached) order is kept. A sorted copy is only
+                # written, for the time it is needed, if ft2csv is used
+                order = ft_order(bin_file, work_dir)
+                if split:
+                    sorted_bin = write_sorted_ft(bin_file, order, work_dir)
+            else:
+                sorted_bin = sort_ft(bin_file, err_file, work_dir)
+                records    = map_ft(sorted_bin)
+                order      = None
+
+            decoded = decode_overheads(records, order, native)
+            del records
+
+            if conf.OVH_BREAKDOWN:
+                breakdown = DirMap()
+                for event, pairs in decoded.iteritems():
+                    if len(pairs.durations):
+                        overhead_breakdown(event, pairs, cycles, breakdown)
+
+                out_dir = "%s/%s" % (work_dir, FT_BREAKDOWN_DIR)
+                if os.path.exists(out_dir):
+                    sh.rmtree(out_dir)
+                if not breakdown.is_empty():
+                    breakdown.write(out_dir)
+
+            decoded = [(e, p.durations) for e, p in decoded.iteritems()]
+            decoded = itertools.chain(decoded,
+                                      split_overheads(sorted_bin, split,
+                                                      work_dir, err_file,
+                                                      procs))
+            for event, data in decoded:
+                if len(data):
+                    store_overhead(result, ovh_bin, event, data, cycles)
+        finally:
+            if sorted_bin and os.path.exists(sorted_bin):
+                os.remove(sorted_bin)
 
         result['SUM'] = Measurement("SUM")
         result['SUM'][Type.Max] = long(0)
@@ -101,10 +370,7 @@ def extract_ft_data(result, data_dir, work_dir, cycles):
         result['SUM'][Type.Var] = long(0)
         result['SUM'][Type.Sum] = long(0)
         for event in conf.OVH_BASE_EVENTS:
-            parse_overhead(result, sorted_bin, event, cycles,
-                           work_dir, err_file)
             if (event in result) and (event in conf.CUMULATIVE_OVERHEAD_LIST):
                 result['SUM'][Type.Sum] += result[event][Type.Sum]
-        os.remove(sorted_bin)
 
     return True
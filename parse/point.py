@@ -27,6 +27,11 @@ def dict_str(adict, sep = "\n"):
     return sep.join([("%" + str(size) + "s: %9s") % (k, num_str(v)) for (k,v) in sorted(adict.iteritems())])
 
 class Measurement(object):
+    # Optional QuantileSketch of the summarized values, which are
+    # sketched values multiplied by scale
+    sketch = None
+    scale  = 1
+
     def __init__(self, id = None, kv = {}, default=list):
         self.id = id
         self.stats = defaultdict(default)
@@ -42,6 +47,21 @@ class Measurement(object):
         self[Type.Sum] = array.sum() 
         return self
 
+    def from_sketch(self, sketch, scale = 1):
+        self[Type.Max] = sketch.max * scale
+        self[Type.Avg] = sketch.mean * scale
+        self[Type.Var] = sketch.var() * scale * scale
+        self[Type.Min] = sketch.min * scale
+        self[Type.Sum] = sketch.sum * scale
+        self.sketch = sketch
+        self.scale  = scale
+        return self
+
+    def percentile(self, which):
+        if self.sketch is None:
+            raise ValueError("measurement '%s' has no sketch" % self.id)
+        return self.sketch.percentile(which) * self.scale
+
     def __check_type(self, type):
         if not type in Type:
             raise AttributeError("Not a valid type '%s'" % type)
@@ -97,6 +117,15 @@ class Summary(Measurement):
                     val = func([m[base_type] for m in measures])
                     self[sum_type][base_type] = val
 
+        # Sketches merge into the distribution of all trials' values
+        sketches = [m.sketch for m in measures]
+        scales = set(m.scale for m in measures)
+        if None not in sketches and len(scales) == 1:
+            self.sketch = copy.deepcopy(sketches[0])
+            for sketch in sketches[1:]:
+                self.sketch.merge(sketch)
+            self.scale = scales.pop()
+
     def __get_required(self, typemap):
         required = []
         for base_type in Type:
@@ -106,6 +135,9 @@ class Summary(Measurement):
         return required
 
 class ExpPoint(object):
+    # Set for points estimated from a sample of the experiment's data
+    approximate = False
+
     def __init__(self, id = "", init = {}, default=Measurement):
         self.stats = defaultdict(default)
         for type, value in init.iteritems():
@@ -147,6 +179,12 @@ class SummaryPoint(ExpPoint):
 
         grouped = defaultdict(lambda : [])
 
+        approximate = set(exp.approximate for exp in points)
+        if len(approximate) > 1:
+            raise ValueError("Cannot summarize approximate points of '%s' "
+                             "with fully parsed ones" % id)
+        self.approximate = bool(approximate) and approximate.pop()
+
         for exp in points:
             for name,measure in exp.stats.iteritems():
                 grouped[name] += [measure]
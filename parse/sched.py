@@ -1,28 +1,40 @@
+import cache
 import config.config as conf
+import multiprocessing
+import numpy as np
 import os
 import re
+import shutil as sh
 import struct
 import subprocess
 
-from collections import defaultdict,namedtuple
+from collections import defaultdict,deque,namedtuple
 from common import recordtype,log_once
+from dir_map import DirMap
 from point import Measurement
+from sketch import QuantileSketch
 from ctypes import *
 from heapq import *
+from multiprocessing.sharedctypes import RawArray
 from config.config import PREEMPTION_THRESHOLD
 
 class EventTraker:
-    def __init__(self, sync_release_time = 0):
+    def __init__(self, sync_release_time = 0, on_preemption = None):
         self.sync_release_time = sync_release_time
+        # Called with the time of each preemption and whether it migrated
+        self.on_preemption = on_preemption
         self.filtered_preemptions= {}
         self.preemptions = {}
         self.migrations = {}
-        self.switch_buffer = []
+        self.switch_buffer = deque()
         self.delay_buffer_size = 1
+
+        # Totals added through add_counts
+        self.counted = [0, 0, 0, 0]
            
     def add_event(self, record, time):
         if len(self.switch_buffer) == self.delay_buffer_size:
-            to_queue = self.switch_buffer.pop(0)     
+            to_queue = self.switch_buffer.popleft()
             if to_queue[0].job == record.job:
                 if to_queue[0].type == 6 and record.type == 5:
                     self.preemptions[to_queue[0].job] += 1
@@ -30,43 +42,99 @@ class EventTraker:
                         self.filtered_preemptions[to_queue[0].job] += 1
                     if to_queue[0].cpu != record.cpu:
                         self.migrations[to_queue[0].job] += 1
-        if not record.job in self.preemptions.keys():
+                    if self.on_preemption:
+                        self.on_preemption(time, to_queue[0].cpu != record.cpu)
+        if not record.job in self.preemptions:
             self.preemptions[record.job] = 0
             self.filtered_preemptions[record.job] = 0
             self.migrations[record.job] = 0
         self.switch_buffer.append((record, time))
+
+    def add_counts(self, preemptions, filtered_preemptions, migrations, jobs):
+        '''Add totals computed elsewhere, e.g. by count_switches.'''
+        counts = (preemptions, filtered_preemptions, migrations, jobs)
+        self.counted = [c + int(n) for c, n in zip(self.counted, counts)]
         
     def get_preemptions(self):
-        sum = 0
-        for job in self.preemptions.keys():
-            sum += self.preemptions[job]
-        return sum
+        return sum(self.preemptions.itervalues()) + self.counted[0]
     
     def get_filtered_preemptions(self):
-        sum = 0
-        for job in self.filtered_preemptions.keys():
-            sum += self.filtered_preemptions[job]
-        return sum
+        return sum(self.filtered_preemptions.itervalues()) + self.counted[1]
     
     def get_migrations(self):
-        sum = 0
-        for job in self.migrations.keys():
-            sum += self.migrations[job]
-        return sum
+        return sum(self.migrations.itervalues()) + self.counted[2]
     
     def get_jobs(self):
-        return len(self.preemptions.keys())
+        return len(self.preemptions) + self.counted[3]
+
+def find_preemptions(switches):
+    '''Stable-sort @switches, switch-to and switch-away records in
+    processing order, by pid. Returns the sorted records and, for each
+    record but the first, whether it ends a preemption, a preemption longer
+    than PREEMPTION_THRESHOLD, and a migration.'''
+    if np.any(switches['pid'][1:] < switches['pid'][:-1]):
+        switches = switches[np.argsort(switches['pid'], kind='mergesort')]
+    pids  = switches['pid']
+    jobs  = switches['job']
+    types = switches['type']
+    cpus  = switches['cpu']
+    when  = switches['when'].astype(np.int64)
+
+    # A preemption is a switch away followed by a switch to of the same job
+    preempted = ((pids[1:] == pids[:-1]) & (jobs[1:] == jobs[:-1]) &
+                 (types[:-1] == 6) & (types[1:] == 5))
+    filtered  = preempted & (when[1:] - when[:-1] > PREEMPTION_THRESHOLD)
+    migrated  = preempted & (cpus[1:] != cpus[:-1])
+
+    return switches, preempted, filtered, migrated
+
+def count_switches(switches):
+    '''Count preemptions, filtered preemptions (longer than
+    PREEMPTION_THRESHOLD), migrations and jobs per pid in @switches, an
+    array of switch-to and switch-away records in processing order. Gives
+    the same counts as feeding each record to its task's EventTraker.
+    Returns (pids, preemptions, filtered preemptions, migrations, jobs).'''
+    switches, preempted, filtered, migrated = find_preemptions(switches)
+    pids = switches['pid']
+    jobs = switches['job']
+
+    uniq, task = np.unique(pids, return_inverse=True)
+    def per_task(flags):
+        return np.bincount(task[1:][flags], minlength=len(uniq))
+
+    by_job  = np.lexsort((jobs, pids))
+    new_job = np.ones(len(by_job), dtype=bool)
+    new_job[1:] = ((pids[by_job][1:] != pids[by_job][:-1]) |
+                   (jobs[by_job][1:] != jobs[by_job][:-1]))
+
+    return (uniq, per_task(preempted), per_task(filtered),
+            per_task(migrated),
+            np.bincount(task[by_job][new_job], minlength=len(uniq)))
     
 class TimeTracker:
-    '''Store stats for durations of time demarcated by sched_trace records.'''
-    def __init__(self, is_valid_duration = lambda x: x > 0, capper = lambda x: x, delay_buffer_size = 1, max_pending = -1, sync_release_time = 0):
+    '''Store stats for durations of time demarcated by sched_trace records.
+    To be fed whole arrays through add_matches, @capper and
+    @is_valid_duration must work on NumPy arrays as well as on numbers.
+    If given, @on_match is called with the start and end (record, time)
+    of each duration matched one record at a time.'''
+    def __init__(self, is_valid_duration = lambda x: x > 0, capper = lambda x: x, delay_buffer_size = 1, max_pending = -1, sync_release_time = 0, on_match = None):
         self.validator = is_valid_duration
         self.capper = capper
+        self.on_match = on_match
         self.avg = self.max = self.num = 0
-        self.all_measurements = []
+
+        # Unless every duration is kept, percentiles come from a sketch
+        # whose size does not grow with the number of durations
+        if conf.SCHED_EXACT_DURATIONS:
+            self.sketch = None
+            self.all_measurements = []
+        else:
+            self.sketch = QuantileSketch()
+            self.all_measurements = None
         self.all_measurements_arr = None
 
         self.matches = 0
+        self.unmatched = 0
 
         self.max_pending = max_pending
         self.discarded = 0
@@ -80,37 +148,66 @@ class TimeTracker:
 
     def disjoints(self):
         unmatched = len(self.start_records) + len(self.end_records)
-        return self.discarded + unmatched
+        return self.discarded + self.unmatched + unmatched
 
     def stdev(self):
+        if self.sketch is not None:
+            return self.sketch.std()
         if self.all_measurements_arr is None:
             self.all_measurements_arr = np.asarray(self.all_measurements)
             self.all_measurements_arr.sort()
         return np.std(self.all_measurements_arr)
 
     def percentile(self, which):
+        if self.sketch is not None:
+            return self.sketch.percentile(which)
         if self.all_measurements_arr is None:
             self.all_measurements_arr = np.asarray(self.all_measurements)
             self.all_measurements_arr.sort()
-        return stats.scoreatpercentile(self.all_measurements_arr, which)
-
-    def process_completed(self):
-        completed = self.start_records.viewkeys() & self.end_records.viewkeys()
-        self.matches += len(completed)
-        for c in completed:
-            s, stime = self.start_records[c]
-            e, etime = self.end_records[c]
-            del self.start_records[c]
-            del self.end_records[c]
-
-            dur = self.capper(etime - stime)
-            if self.validator(dur):
-                self.max = max(self.max, dur)
-                old_avg = self.avg * self.num
-                self.num += 1
-                self.avg = (old_avg + dur) / float(self.num)
+        return np.percentile(self.all_measurements_arr, which)
+
+    def add_duration(self, dur):
+        dur = self.capper(dur)
+        if self.validator(dur):
+            self.max = max(self.max, dur)
+            old_avg = self.avg * self.num
+            self.num += 1
+            self.avg = (old_avg + dur) / float(self.num)
+            if self.sketch is not None:
+                self.sketch.add(dur)
+            else:
                 self.all_measurements.append(dur)
-                
+
+    def add_matches(self, durations, unmatched = 0):
+        '''Store many matched @durations at once, as well as the number of
+        records which will never be matched (see match_times).'''
+        self.matches += len(durations)
+        self.unmatched += unmatched
+
+        durations = self.capper(durations)
+        valid = durations[self.validator(durations)]
+        if not len(valid):
+            return
+
+        self.max = max(self.max, valid.max())
+        old_avg = self.avg * self.num
+        self.num += len(valid)
+        self.avg = (old_avg + valid.sum()) / float(self.num)
+        if self.sketch is not None:
+            self.sketch.add_array(valid)
+        else:
+            self.all_measurements.extend(valid.tolist())
+
+    def process_completed(self, job):
+        '''Match @job, which just arrived, with its counterpart, if any.'''
+        if job in self.start_records and job in self.end_records:
+            self.matches += 1
+            s, stime = self.start_records.pop(job)
+            e, etime = self.end_records.pop(job)
+            self.add_duration(etime - stime)
+            if self.on_match:
+                self.on_match((s, stime), (e, etime))
+
         # Give up on some jobs if they've been hanging around too long.
         # While not strictly needed, it helps improve performance and
         # it is unlikey to cause too much trouble.
@@ -132,27 +229,249 @@ class TimeTracker:
         if len(self.end_delay_buffer) == self.delay_buffer_size:
             to_queue = self.end_delay_buffer.pop(0)
             self.end_records[to_queue[0].job] = to_queue
+            self.process_completed(to_queue[0].job)
         self.end_delay_buffer.append((record, time))
-        self.process_completed()
 
     def start_time(self, record, time):
         '''Start duration of time.'''
         if len(self.start_delay_buffer) == self.delay_buffer_size:
             to_queue = self.start_delay_buffer.pop(0)
             self.start_records[to_queue[0].job] = to_queue
+            self.process_completed(to_queue[0].job)
         self.start_delay_buffer.append((record, time))
-        self.process_completed()
+
+class WindowTracker:
+    '''Sum sched_trace statistics over windows of @width ns, as records are
+    processed, so that memory grows with the number of windows rather than
+    of records. Windows start at the first system release any task takes,
+    or at the first job release if there is none. Jobs, completions and
+    tardiness count in the window their job was released in; block times,
+    preemptions and migrations in the window they began in. Values are fed
+    one at a time or as whole arrays.'''
+    STATS = ['jobs', 'done', 'tardy', 'tard-sum', 'tard-max', 'block-sum',
+             'preemptions', 'migrations']
+
+    def __init__(self, width):
+        self.width = width
+        self.start = None
+        # Until a system release is seen, windows start at the first job
+        self.synced = False
+        self.sums = dict((stat, defaultdict(int)) for stat in self.STATS)
+
+    def set_start(self, at):
+        '''Start windows at system release time @at, unless a system
+        release was seen before. Anything counted before it is dropped, as
+        it all happened before @at.'''
+        if self.synced:
+            return
+        self.start, self.synced = at, True
+        for sums in self.sums.itervalues():
+            sums.clear()
+
+    def window(self, time):
+        if self.start is None or time < self.start:
+            return -1
+        return int(time - self.start) // self.width
+
+    def add(self, stat, time, value = 1):
+        window = self.window(time)
+        if window >= 0:
+            self.sums[stat][window] += value
+
+    def add_release(self, time):
+        if self.start is None:
+            self.start = time
+        self.add('jobs', time)
+
+    def add_completion(self, release, tardiness):
+        self.add('done', release)
+        if tardiness > 0:
+            self.add('tardy', release)
+            self.add('tard-sum', release, tardiness)
+            window = self.window(release)
+            if window >= 0:
+                top = self.sums['tard-max']
+                top[window] = max(top[window], tardiness)
+
+    def add_block(self, start, duration):
+        self.add('block-sum', start, max(duration, 0))
+
+    def add_preemption(self, time, migrated):
+        self.add('preemptions', time)
+        if migrated:
+            self.add('migrations', time)
+
+    def add_array(self, stat, times, values = None, combine = np.add):
+        '''Combine @values (1 each by default) into @stat of the windows
+        of @times, with an element-wise @combine such as np.add.'''
+        if self.start is None or not len(times):
+            return
+        windows = (np.asarray(times, dtype=np.int64) - self.start) // self.width
+        keep = windows >= 0
+        windows = windows[keep]
+        if values is None:
+            values = np.ones(len(windows), dtype=np.int64)
+        else:
+            values = np.asarray(values)[keep]
+
+        found = np.unique(windows)
+        total = np.zeros(len(found), dtype=values.dtype)
+        combine.at(total, np.searchsorted(found, windows), values)
+
+        sums = self.sums[stat]
+        for window, value in zip(found.tolist(), total.tolist()):
+            if combine is np.maximum:
+                sums[window] = max(sums[window], value)
+            else:
+                sums[window] += value
+
+    def add_releases(self, times):
+        if self.start is None and len(times):
+            self.start = int(times[0])
+        self.add_array('jobs', times)
+
+    def add_completions(self, releases, tardiness):
+        tardy = tardiness > 0
+        self.add_array('done', releases)
+        self.add_array('tardy', releases[tardy])
+        self.add_array('tard-sum', releases[tardy], tardiness[tardy])
+        self.add_array('tard-max', releases[tardy], tardiness[tardy],
+                       np.maximum)
+
+    def add_blocks(self, starts, durations):
+        self.add_array('block-sum', starts, np.maximum(durations, 0))
+
+    def add_preemptions(self, times, migrated):
+        self.add_array('preemptions', times)
+        self.add_array('migrations', times[migrated])
+
+    def stats(self):
+        '''Return a map of stat names to (window start in ms, value) lists.
+        Tardiness and block times are in ms. Windows in which no released
+        job completed, e.g. at the very end of a trace, are left out rather
+        than reported as free of misses.'''
+        full = sorted(w for w, count in self.sums['done'].iteritems()
+                      if count > 0)
+
+        def column(stat, dtype = np.int64):
+            return np.array([self.sums[stat][w] for w in full], dtype=dtype)
+
+        jobs, done = column('jobs'), column('done')
+        ms = float(NSEC_PER_MSEC)
+        stats = {'jobs'       : jobs,
+                 'miss-ratio' : column('tardy', float) / done,
+                 'tard-avg'   : column('tard-sum', float) / done / ms,
+                 'tard-max'   : column('tard-max', float) / ms,
+                 'block-avg'  : column('block-sum', float) / jobs.clip(1) / ms,
+                 'preemptions': column('preemptions'),
+                 'migrations' : column('migrations')}
+
+        times = np.array(full) * (self.width / ms)
+        return dict((name, zip(times, values))
+                    for name, values in stats.iteritems())
+
+def delayed(pids, positions):
+    '''Return the indices of the events at @positions which a TimeTracker
+    delay buffer (of size 1) lets through, and the positions at which it does:
+    each event is held until the next event of the same pid arrives.'''
+    order = np.lexsort((positions, pids))
+    same  = pids[order][1:] == pids[order][:-1]
+    return order[:-1][same], positions[order][1:][same]
+
+def match_times(starts, ends, start_index = False):
+    '''Pair the (pid, job, time, position) arrays of @starts and @ends by
+    (pid, job), exactly as per-pid TimeTrackers do when start_time and
+    end_time are called in position order. Returns the pid, job and
+    duration of each matched pair and the pid of each record left
+    unmatched, and, if @start_index, the index in @starts of the start of
+    each pair.'''
+    s_idx, s_at = delayed(starts[0], starts[3])
+    e_idx, e_at = delayed(ends[0], ends[3])
+
+    def join(i):
+        return np.concatenate((starts[i][s_idx], ends[i][e_idx])).astype(np.int64)
+
+    pids, jobs, times = join(0), join(1), join(2)
+    is_end = np.concatenate((np.zeros(len(s_idx), dtype=bool),
+                             np.ones(len(e_idx), dtype=bool)))
+    index  = np.concatenate((s_idx, e_idx))
+
+    order = np.lexsort((np.concatenate((s_at, e_at)), jobs, pids))
+    pids, jobs, times, is_end = pids[order], jobs[order], times[order], is_end[order]
+    index = index[order]
+
+    count = len(order)
+    if not count:
+        return (pids, jobs, times, pids) + ((pids,) if start_index else ())
+
+    # Consecutive starts (or ends) of a job overwrite each other, leaving
+    # only the last of a run pending, and a start matches the first end
+    # of the run that follows it (or vice versa)
+    new_key = np.ones(count, dtype=bool)
+    new_key[1:] = (pids[1:] != pids[:-1]) | (jobs[1:] != jobs[:-1])
+    new_run = new_key.copy()
+    new_run[1:] |= is_end[1:] != is_end[:-1]
+
+    first = np.flatnonzero(new_run)
+    last  = np.append(first[1:], count) - 1
+    runs  = np.arange(len(first))
+    key_start = new_key[first]
+    key_first = np.maximum.accumulate(np.where(key_start, runs, 0))
+
+    # A run leaves a record pending if it has several records, or if nothing
+    # was pending before it. Between runs of several records, runs of one
+    # record therefore alternate between pending and matched.
+    multi = np.maximum.accumulate(np.where(last > first, runs, -1))
+    has_multi = multi >= key_first
+    base = np.where(has_multi, multi, key_first - 1)
+    pending = has_multi ^ ((runs - base) % 2 == 1)
+
+    matched = np.zeros(len(first), dtype=bool)
+    matched[1:] = pending[:-1] & ~key_start[1:]
+    a, b = last[runs[matched] - 1], first[matched]
+    durations = np.where(is_end[b], times[b] - times[a], times[a] - times[b])
+
+    key_last = np.append(key_start[1:], True)
+    unmatched = first[key_last & pending]
+
+    matches = (pids[b], jobs[b], durations, pids[unmatched])
+    if start_index:
+        matches += (np.where(is_end[b], index[a], index[b]),)
+    return matches
+
+def split_by_pid(pids, *arrays):
+    '''Yield (pid, array slices...) for each distinct pid in @pids.'''
+    order = np.argsort(pids, kind='mergesort')
+    uniq, lo = np.unique(pids[order], return_index=True)
+    hi = np.append(lo[1:], len(order))
+    for pid, l, h in zip(uniq.tolist(), lo.tolist(), hi.tolist()):
+        yield (pid,) + tuple(a[order[l:h]] for a in arrays)
 
 # Data stored for each task
 TaskParams = namedtuple('TaskParams',  ['wcet', 'period', 'cpu'])
-TaskData   = recordtype('TaskData',    ['params', 'jobs', 'blocks', 'misses', 'preemptions'])
+TaskData   = recordtype('TaskData',    ['params', 'jobs', 'blocks', 'misses', 'preemptions', 'extra', 'windows'])
 
 # Map of event ids to corresponding class and format
 record_map = {}
 
+# Map of event ids to the NumPy dtype of a whole record of that event
+record_dtypes = {}
+
+# Map of event ids to the batch() method of their record class
+record_handlers = {}
+
 RECORD_SIZE   = 24
 NSEC_PER_MSEC = 1000000
 
+# Sorted records of all sched-trace files, cached in an experiment's work dir
+ST_CACHE_NAME = "sched-columns.npz"
+# Per-job data, written next to an experiment's parsed results
+JOB_TABLE_NAME = "jobs.npz"
+# Index of a sched-trace file by pid and time, cached in the work dir
+ST_INDEX_NAME = "%s.idx.npz"
+# Per-window time series, written as a directory plot_exps.py can plot
+WINDOW_DIR_NAME = "windows"
+
 def bits_to_bytes(bits):
     '''Includes padding'''
     return bits / 8 + (1 if bits%8 else 0)
@@ -178,6 +497,15 @@ def field_bytes(fields):
     fbytes += bits_to_bytes(fbits)
     return fbytes + fbits
 
+def make_dtype(fields):
+    '''Little-endian NumPy dtype with the same layout as ctypes @fields.'''
+    dtype_fields = []
+    for f in fields:
+        if len(f) > 2:
+            raise ValueError("Bitfield '%s' has no NumPy equivalent" % f[0])
+        dtype_fields += [(f[0], np.dtype(f[1]).newbyteorder('<'))]
+    return np.dtype(dtype_fields)
+
 def register_record(id, clazz):
     fields = clazz.FIELDS
     diff = RECORD_SIZE - field_bytes(SchedRecord.FIELDS) - field_bytes(fields)
@@ -195,13 +523,27 @@ def register_record(id, clazz):
                    '_pack_'  : 1})
     record_map[id] = clazz2
 
-def make_iterator(fname):
+    dtype = make_dtype(SchedRecord.FIELDS + fields)
+    if dtype.itemsize != RECORD_SIZE:
+        raise ValueError("Record %d is %d bytes, not %d" %
+                         (id, dtype.itemsize, RECORD_SIZE))
+    record_dtypes[id] = dtype
+
+    if clazz.batch:
+        record_handlers[id] = clazz.batch
+
+def make_iterator(fname, disorder = None):
     '''Iterate over (parsed record, processing method) in a
-    sched-trace file.'''
+    sched-trace file. See make_mmap_iterator for @disorder.'''
     if not os.path.getsize(fname):
         # Likely a release master CPU
         return
 
+    if conf.SCHED_MMAP:
+        for obj in make_mmap_iterator(fname, disorder):
+            yield obj
+        return
+
     f = open(fname, 'rb')
 
     while True:
@@ -225,49 +567,101 @@ def make_iterator(fname):
             # Results from the first job are nonsense
             pass
 
-def read_data(task_dict, fnames):
+def read_data(task_dict, fnames, work_dir = None, procs = 1):
     '''Read records from @fnames and store per-pid stats in @task_dict.'''
+    if conf.SCHED_COLUMNAR:
+        read_columnar_data(task_dict, fnames, work_dir, procs)
+        return
+    if conf.SCHED_MERGE == 'sort':
+        read_sorted_data(task_dict, fnames)
+        return
 
     # A time-stamp ordered heap
     q = []
 
-    # Number of trace records to q from each stream/file. A heap
-    # of this size is maintained in order to deal with events that
-    # were recorded out-of-order.
-    window_size = 500
+    # Records are only processed once every stream has been read this far
+    # (in ns) past them: the largest jump back in time within a stream so
+    # far, which grows as the streams are read (a chunk ahead with
+    # SCHED_MMAP). Well-ordered traces keep few records queued, while
+    # records from buffers flushed late are processed in order once a jump
+    # that large has been seen. Memory is bounded by the number of queued
+    # records instead
+    disorder = [0]
+    max_queued = max(conf.SCHED_MAX_QUEUED, 1)
+    late = [0]
+    last_time = [0]
 
     def get_time(record):
         return record.when if hasattr(record, 'when') else 0
 
-    def add_record(itera):
+    def add_record(stream):
+        '''Queue the next record of @stream, or return False at its end.'''
+        horizon, itera = stream
         try:
             arecord = itera.next()
         except StopIteration:
-            return
-        sort_key = (get_time(arecord), arecord.job, arecord.pid)
+            return False
+
+        when = get_time(arecord)
+        if when and when < last_time[0]:
+            late[0] += 1
+        if when:
+            disorder[0] = max(disorder[0], horizon - when)
+        sort_key = (when, arecord.job, arecord.pid)
         heappush(q, (sort_key, arecord, itera))
 
+        stream[0] = max(horizon, when)
+        return True
+
+    # Streams ordered by how far they have been read
+    streams = []
     for fname in fnames:
-        itera = make_iterator(fname)
-        for w in range(window_size):
-            add_record(itera)
+        stream = [0, make_iterator(fname, disorder)]
+        if add_record(stream):
+            streams += [stream]
+    heapify(streams)
 
     while q:
+        # Read ahead until no stream can hold a record preceding q's head
+        while streams and streams[0][0] <= q[0][0][0] + disorder[0] and\
+              len(q) < max_queued:
+            if add_record(streams[0]):
+                heapreplace(streams, streams[0])
+            else:
+                heappop(streams)
+
         sort_key, record, itera = heappop(q)
-        # fetch another recrod
-        add_record(itera)
+        last_time[0] = max(last_time[0], sort_key[0])
         record.process(task_dict)
 
+    if late[0]:
+        log_once("%d sched_trace records in %s were processed out of "
+                 "order, as they jumped back in time further than any "
+                 "record read before them, or more than %d records had "
+                 "to be held back" %
+                 (late[0], os.path.dirname(fnames[0]), max_queued))
+
 class SchedRecord(object):
     # Subclasses will have their FIELDs merged into this one
     FIELDS = [('type', c_uint8),  ('cpu', c_uint8),
               ('pid',  c_uint16), ('job', c_uint32)]
 
+    # Optional classmethod batch(task_dict, records, positions), called by
+    # the columnar parser after the built-in events with the sorted records
+    # of the event, as an array of its dtype. As with switches, only
+    # records following the params of their task and the latest system
+    # release are passed. It can store per-task values in
+    # task_dict[pid].extra, which are summarized like the rest, counting
+    # tasks which have none as 0
+    batch = None
+
     def fill(self, data):
         memmove(addressof(self), data, RECORD_SIZE)
 
     def process(self, task_dict):
-        raise NotImplementedError()
+        '''Process a single record. Records with only a batch() method are
+        ignored unless SCHED_COLUMNAR is set.'''
+        pass
 
 class ParamRecord(SchedRecord):
     FIELDS = [('wcet', c_uint32),  ('period', c_uint32),
@@ -287,6 +681,8 @@ class ReleaseRecord(SchedRecord):
         data.jobs += 1
         if data.params and self.when >= task_dict[self.pid].misses.sync_release_time:
             data.misses.start_time(self, self.deadline)
+            if data.windows:
+                data.windows.add_release(self.when)
 
 class CompletionRecord(SchedRecord):
     FIELDS = [('when', c_uint64)]
@@ -328,6 +724,21 @@ class SysReleaseRecord(SchedRecord):
         for k in task_dict:
             task_dict[k].misses.sync_release_time = self.at
             task_dict[k].preemptions.sync_release_time = self.at
+            if task_dict[k].windows:
+                task_dict[k].windows.set_start(self.at)
+
+class ActionRecord(SchedRecord):
+    FIELDS = [('when', c_uint64), ('action', c_uint8)]
+
+    def process(self, task_dict):
+        data = task_dict[self.pid]
+        if data.params and self.when >= data.preemptions.sync_release_time:
+            data.extra['actions'] = data.extra.get('actions', 0) + 1
+
+    @classmethod
+    def batch(cls, task_dict, records, positions):
+        for pid, count in zip(*np.unique(records['pid'], return_counts=True)):
+            task_dict[pid].extra['actions'] = count
 
 # Map records to sched_trace ids (see include/litmus/sched_trace.h
 register_record(2, ParamRecord)
@@ -337,34 +748,669 @@ register_record(6, SwitchAwayRecord)
 register_record(7, CompletionRecord)
 register_record(8, BlockRecord)
 register_record(9, ResumeRecord)
+register_record(10, ActionRecord)
 register_record(11, SysReleaseRecord)
 
-def create_task_dict(data_dir, work_dir = None):
+# Any record, with its event-specific data left undecoded
+RAW_DTYPE = np.dtype(make_dtype(SchedRecord.FIELDS).descr +
+                     [('data', 'V%d' % (RECORD_SIZE - 8))])
+
+def read_records(fname):
+    '''Read every record in sched-trace file @fname with a single call.
+    Returns an array of RAW_DTYPE.'''
+    count = os.path.getsize(fname) / RECORD_SIZE
+    if not count:
+        # Likely a release master CPU
+        return np.empty(0, dtype=RAW_DTYPE)
+    if conf.SCHED_MMAP:
+        return map_records(fname)
+    return np.fromfile(fname, dtype=RAW_DTYPE, count=count)
+
+def map_records(fname):
+    '''Map sched-trace file @fname read-only as an array of RAW_DTYPE.
+    Nothing is read until the array is accessed.'''
+    count = os.path.getsize(fname) / RECORD_SIZE
+    if not count:
+        return np.empty(0, dtype=RAW_DTYPE)
+    return np.memmap(fname, dtype=RAW_DTYPE, mode='r', shape=(count,))
+
+def iter_chunks(fname, chunk_size=None):
+    '''Yield read-only views of at most @chunk_size records of @fname.'''
+    chunk_size = chunk_size or conf.SCHED_CHUNK_RECORDS
+    records = map_records(fname)
+    for start in xrange(0, len(records), chunk_size):
+        yield records[start:start + chunk_size]
+
+def iter_columns(fname, chunk_size=None):
+    '''Yield per-event record arrays for @fname one chunk at a time. Memory
+    use is bounded by @chunk_size, not by the size of the file.'''
+    for chunk in iter_chunks(fname, chunk_size):
+        yield split_records(chunk)
+
+def chunk_disorder(chunk, horizon):
+    '''Return how far back in time (ns) any timed record of RAW_DTYPE
+    @chunk lies behind an earlier record, or @horizon, the latest time
+    before it, and the latest time up to the end of @chunk.'''
+    keep, when = record_times(chunk)
+    when = when[keep]
+    if not len(when):
+        return 0, horizon
+    ahead = np.maximum(np.maximum.accumulate(when), horizon)
+    return int((ahead - when).max()), int(ahead[-1])
+
+def make_mmap_iterator(fname, disorder = None):
+    '''Iterate over parsed records like make_iterator, but walk a read-only
+    mapping of @fname a chunk at a time instead of reading each record.
+    If given, @disorder[0] is raised to the largest jump back in time (ns)
+    within @fname as it is walked, a chunk ahead of the records yielded.'''
+    known = record_map.keys()
+    horizon = [0]
+
+    def measured(chunk):
+        if disorder is not None and chunk is not None:
+            jump, horizon[0] = chunk_disorder(chunk, horizon[0])
+            disorder[0] = max(disorder[0], jump)
+        return chunk
+
+    chunks = iter_chunks(fname)
+    ahead  = measured(next(chunks, None))
+    while ahead is not None:
+        chunk, ahead = ahead, measured(next(chunks, None))
+        # Results from the first job are nonsense
+        keep  = np.in1d(chunk['type'], known) & (chunk['job'] != 1)
+        types = chunk['type'].tolist()
+        data  = chunk.tobytes()
+
+        for i in np.flatnonzero(keep).tolist():
+            clazz = record_map[types[i]]
+            yield clazz.from_buffer_copy(data, i * RECORD_SIZE)
+
+def record_times(records):
+    '''Return the 'when' time stamp of each of RAW_DTYPE @records, and
+    whether the record has one (and is not from the first job).'''
+    timed = [t for t, dtype in record_dtypes.iteritems() if 'when' in dtype.names]
+    # 'when' is the first field of every timed record
+    dtype = np.dtype(RAW_DTYPE.descr[:-1] +
+                     [('when', '<u8'), ('rest', 'V%d' % (RECORD_SIZE - 16))])
+
+    keep = np.in1d(records['type'], timed) & (records['job'] != 1)
+    return keep, records.view(dtype)['when'].astype(np.int64)
+
+def split_records(records):
+    '''Split an array of RAW_DTYPE @records into a map of event id ->
+    array of that event's record dtype. Like make_iterator, unknown events
+    and events from the first job are dropped.'''
+    records = records[records['job'] != 1]
+
+    # A stable sort keeps the records of each type in file order
+    order   = np.argsort(records['type'], kind='mergesort')
+    records = records[order]
+    types   = records['type']
+
+    columns = {}
+    for type_num, dtype in record_dtypes.iteritems():
+        lo, hi = np.searchsorted(types, [type_num, type_num + 1])
+        columns[type_num] = records[lo:hi].view(dtype)
+    return columns
+
+def read_columns(fnames):
+    '''Decode and join per-event record arrays of sched-trace files
+    @fnames. Files are split a chunk at a time (see iter_columns) into
+    arrays of their final size, so each kept record is only held once.'''
+    counts = defaultdict(int)
+    for fname in fnames:
+        for chunk in iter_chunks(fname):
+            types = chunk['type'][chunk['job'] != 1]
+            for type_num, count in zip(*np.unique(types, return_counts=True)):
+                counts[int(type_num)] += int(count)
+
+    columns = dict((type_num, np.empty(counts[type_num], dtype=dtype))
+                   for type_num, dtype in record_dtypes.iteritems())
+    filled  = defaultdict(int)
+    for fname in fnames:
+        for chunk_columns in iter_columns(fname):
+            for type_num, arr in chunk_columns.iteritems():
+                start = filled[type_num]
+                columns[type_num][start:start + len(arr)] = arr
+                filled[type_num] += len(arr)
+    return columns
+
+def concat_columns(column_maps):
+    '''Join per-event record arrays from several files.'''
+    columns = {}
+    for type_num, dtype in record_dtypes.iteritems():
+        arrs = [c[type_num] for c in column_maps if type_num in c]
+        columns[type_num] = np.concatenate(arrs) if arrs else\
+                            np.empty(0, dtype=dtype)
+    return columns
+
+def read_all_columns(fnames, procs = 1):
+    '''Decode and join per-event record arrays of all @fnames, using up to
+    @procs worker processes.'''
+    # Daemonic processes, like those of a multiprocessing.Pool, cannot
+    # start processes of their own
+    size = sum(os.path.getsize(f) for f in fnames)
+    if procs > 1 and len(fnames) > 1 and size >= conf.SCHED_PARALLEL_BYTES\
+       and not multiprocessing.current_process().daemon:
+        return concat_columns(read_columns_parallel(fnames, procs))
+    return read_columns(fnames)
+
+# Buffers shared with the workers of read_columns_parallel
+__shared_records = []
+
+def set_shared_records(buffers):
+    global __shared_records
+    __shared_records = buffers
+
+def decode_shared(index_fname):
+    '''Decode a sched-trace file into shared buffer @index, grouping its
+    records by event type. Returns the (event id, count) of each group.'''
+    # Tupled for multiprocessing
+    index, fname = index_fname
+
+    records = read_records(fname)
+    keep    = np.in1d(records['type'], record_dtypes.keys())
+    records = records[keep & (records['job'] != 1)]
+    records = records[np.argsort(records['type'], kind='mergesort')]
+
+    out = np.frombuffer(__shared_records[index], dtype=RAW_DTYPE,
+                        count=len(records))
+    out[:] = records
+
+    types, counts = np.unique(records['type'], return_counts=True)
+    return zip(types.tolist(), counts.tolist())
+
+def read_columns_parallel(fnames, procs):
+    '''Decode each of @fnames in one of @procs worker processes. Workers
+    write records into shared memory, which the returned per-event record
+    arrays are views of.'''
+    buffers = [RawArray('c', max(os.path.getsize(f), RECORD_SIZE))
+               for f in fnames]
+
+    pool = multiprocessing.Pool(processes=min(procs, len(fnames)),
+                                initializer=set_shared_records,
+                                initargs=(buffers,))
+    try:
+        groups = pool.map(decode_shared, enumerate(fnames))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    column_maps = []
+    for buf, type_counts in zip(buffers, groups):
+        count   = sum(c for _, c in type_counts)
+        records = np.frombuffer(buf, dtype=RAW_DTYPE, count=count)
+
+        columns, start = {}, 0
+        for type_num, c in type_counts:
+            view = records[start:start + c].view(record_dtypes[type_num])
+            columns[type_num] = view
+            start += c
+        column_maps += [columns]
+
+    return column_maps
+
+def sort_columns(columns):
+    '''Put per-event record arrays @columns into processing order, the
+    (when, job, pid) order used by read_data, across all events at once.
+    Returns (sorted columns, positions), where positions maps each event id
+    to the global rank of each of its records. Arrays are removed from
+    @columns as they are sorted, so that they can be freed.'''
+    types = sorted(columns)
+    if not types:
+        return {}, {}
+
+    starts = np.cumsum([0] + [len(columns[t]) for t in types])
+    whens   = np.zeros(starts[-1], dtype=np.uint64)
+    job_pid = np.empty(starts[-1], dtype=np.uint64)
+    labels  = np.empty(starts[-1], dtype=np.uint8)
+
+    for i, type_num in enumerate(types):
+        arr = columns[type_num]
+        at  = slice(starts[i], starts[i + 1])
+        if 'when' in arr.dtype.names:
+            whens[at] = arr['when']
+        # Jobs are 32 bits and pids 16, so one key orders by both
+        job_pid[at] = job_keys(arr['pid'], arr['job'])
+        labels[at]  = i
+
+    order = np.lexsort((job_pid, whens))
+    del job_pid, whens
+    labels = labels[order]
+
+    sorted_columns, positions = {}, {}
+    for i, type_num in enumerate(types):
+        at = np.flatnonzero(labels == i)
+        arr = columns.pop(type_num)
+        sorted_columns[type_num] = arr[order[at] - starts[i]]
+        positions[type_num] = at
+
+    return sorted_columns, positions
+
+def read_sorted_data(task_dict, fnames):
+    '''Like read_data, but sort all records of @fnames at once. Unlike the
+    window used by read_data, this handles arbitrarily late records.'''
+    columns, positions = sort_columns(read_columns(fnames))
+
+    count = sum(len(p) for p in positions.itervalues())
+    types = np.empty(count, dtype=np.uint8)
+    index = np.empty(count, dtype=np.int64)
+    data  = {}
+    for type_num, at in positions.iteritems():
+        types[at] = type_num
+        index[at] = np.arange(len(at))
+        data[type_num] = columns[type_num].tobytes()
+
+    for type_num, i in zip(types.tolist(), index.tolist()):
+        clazz  = record_map[type_num]
+        record = clazz.from_buffer_copy(data[type_num], i * RECORD_SIZE)
+        record.process(task_dict)
+
+def read_columnar_data(task_dict, fnames, work_dir = None, procs = 1):
+    '''Like read_sorted_data, but process the records of each event type
+    as whole arrays rather than one at a time. Sorted records are cached
+    in @work_dir, if given, and only decoded again if @fnames change.'''
+    if work_dir and conf.SCHED_CACHE:
+        columns, positions = read_cached_columns(fnames, work_dir, procs)
+    else:
+        columns, positions = sort_columns(read_all_columns(fnames, procs))
+    process_columns(task_dict, columns, positions)
+
+    if work_dir and conf.SCHED_JOB_TABLE:
+        table = make_job_table(columns, positions)
+        np.savez_compressed("%s/%s" % (work_dir, JOB_TABLE_NAME), **table)
+
+def read_cached_columns(fnames, work_dir, procs = 1):
+    '''Return sorted columns and positions of records in @fnames, decoding
+    them only if they are not cached in @work_dir already.'''
+    cache_file = "%s/%s" % (cache.cache_dir(work_dir), ST_CACHE_NAME)
+    # Records of events registered since caching would be missing
+    key = ",".join(cache.file_key(f) for f in sorted(fnames)) +\
+          ":%s" % sorted(record_dtypes)
+
+    arrays = cache.load_arrays(cache_file, key)
+    if arrays is not None:
+        return arrays_to_columns(arrays)
+
+    columns, positions = sort_columns(read_all_columns(fnames, procs))
+    cache.save_arrays(cache_file, key, columns_to_arrays(columns, positions))
+
+    return columns, positions
+
+def columns_to_arrays(columns, positions):
+    '''Flatten @columns and @positions into a map of names to plain arrays,
+    leaving out constant and padding fields.'''
+    arrays = {}
+    for type_num, arr in columns.iteritems():
+        arrays["%d_pos" % type_num] = positions[type_num]
+        for name in arr.dtype.names:
+            if name != 'type' and not name.startswith('extra'):
+                arrays["%d_%s" % (type_num, name)] = arr[name]
+    return arrays
+
+def arrays_to_columns(arrays):
+    '''Undo columns_to_arrays.'''
+    columns, positions = {}, {}
+    for type_num, dtype in record_dtypes.iteritems():
+        at  = arrays.get("%d_pos" % type_num, np.empty(0, dtype=np.int64))
+        arr = np.zeros(len(at), dtype=dtype)
+        arr['type'] = type_num
+        for name in dtype.names:
+            if "%d_%s" % (type_num, name) in arrays:
+                arr[name] = arrays["%d_%s" % (type_num, name)]
+        columns[type_num], positions[type_num] = arr, at
+    return columns, positions
+
+def make_index(records, block = None):
+    '''Index RAW_DTYPE @records by pid and by time. Returns a map with
+    the record numbers of each pid, grouped in file order, and the earliest
+    and latest time of each block of @block records.'''
+    block = block or conf.SCHED_INDEX_BLOCK
+    pids  = records['pid']
+    order = np.argsort(pids, kind='mergesort')
+    uniq, starts = np.unique(pids[order], return_index=True)
+
+    keep, when = record_times(records)
+    edges = np.arange(0, len(records), block)
+    if len(edges):
+        # Blocks without timed records get an empty range
+        block_min = np.minimum.reduceat(
+            np.where(keep, when, np.iinfo(np.int64).max), edges)
+        block_max = np.maximum.reduceat(np.where(keep, when, -1), edges)
+    else:
+        block_min = block_max = np.empty(0, dtype=np.int64)
+
+    return {'block'     : np.array(block),
+            'pids'      : uniq,
+            'pid_starts': np.append(starts, len(order)),
+            'pid_order' : order,
+            'block_min' : block_min,
+            'block_max' : block_max}
+
+def load_index(fname, work_dir = None):
+    '''Return the make_index of sched-trace file @fname, cached in
+    @work_dir, if given, and only built again if @fname changes.'''
+    if not work_dir:
+        return make_index(map_records(fname))
+
+    index_file = "%s/%s" % (cache.cache_dir(work_dir),
+                            ST_INDEX_NAME % os.path.basename(fname))
+    key = "%s:%d" % (cache.file_key(fname), conf.SCHED_INDEX_BLOCK)
+
+    index = cache.load_arrays(index_file, key)
+    if index is None:
+        index = make_index(map_records(fname))
+        cache.save_arrays(index_file, key, index)
+    return index
+
+def task_records(fnames, pid, work_dir = None):
+    '''Return the records of task @pid in sched-trace @fnames as sorted
+    per-event record arrays. Through the index of each file, only the
+    task's own records are read.'''
+    column_maps = []
+    for fname in fnames:
+        index = load_index(fname, work_dir)
+        at = np.searchsorted(index['pids'], pid)
+        if at == len(index['pids']) or index['pids'][at] != pid:
+            continue
+
+        lo, hi = index['pid_starts'][at:at + 2]
+        rows = index['pid_order'][lo:hi]
+        column_maps += [split_records(map_records(fname)[rows])]
+
+    return sort_columns(concat_columns(column_maps))[0]
+
+def time_records(fnames, start, end, work_dir = None):
+    '''Return the timed records of sched-trace @fnames with @start <= when
+    < @end as sorted per-event record arrays. Through the index of each
+    file, only the blocks of records overlapping that range are read.'''
+    column_maps = []
+    for fname in fnames:
+        index = load_index(fname, work_dir)
+        block = int(index['block'])
+        hits  = np.flatnonzero((index['block_max'] >= start) &
+                               (index['block_min'] < end))
+        if not len(hits):
+            continue
+
+        records = map_records(fname)
+        records = np.concatenate([records[b * block:(b + 1) * block]
+                                  for b in hits.tolist()])
+        keep, when = record_times(records)
+        keep &= (when >= start) & (when < end)
+        column_maps += [split_records(records[keep])]
+
+    return sort_columns(concat_columns(column_maps))[0]
+
+def process_columns(task_dict, columns, positions):
+    '''Store per-pid stats in @task_dict for sorted @columns of records with
+    global @positions, with the same results as calling each record's
+    process() method in position order.'''
+    never = np.iinfo(np.int64).max
+
+    # A task exists from its first record on. Only tasks which exist when
+    # a system release record is processed take its release time.
+    first_pos = np.repeat(never, 1 << 16)
+    for type_num, arr in columns.iteritems():
+        if type_num != 11:
+            np.minimum.at(first_pos, arr['pid'], positions[type_num])
+
+    for pid in np.flatnonzero(first_pos != never).tolist():
+        task_dict[pid]
+
+    param_pos = np.repeat(never, 1 << 16)
+    params = columns[2]
+    for p, pos in zip(params.tolist(), positions[2].tolist()):
+        pid = p[2]
+        task_dict[pid].params = TaskParams(p[4], p[5], p[7])
+        param_pos[pid] = min(param_pos[pid], pos)
+
+    sys_pos = positions[11]
+    sys_at  = columns[11]['at'].astype(np.int64)
+
+    # Every task shares the windows of the experiment, if they are kept.
+    # They start at the first system release processed once a task exists
+    windows = next(task_dict.itervalues()).windows if task_dict else None
+    if windows:
+        taken = np.flatnonzero(sys_pos > first_pos.min())
+        if len(taken):
+            windows.set_start(sys_at[taken[0]])
+
+    def sync_release_time(pids, at):
+        if not len(sys_pos):
+            return np.zeros(len(pids), dtype=np.int64)
+        last  = np.searchsorted(sys_pos, at) - 1
+        valid = (last >= 0) & (sys_pos[last.clip(0)] > first_pos[pids])
+        return np.where(valid, sys_at[last.clip(0)], 0)
+
+    def synced(type_num, check_params):
+        arr, at = columns[type_num], positions[type_num]
+        keep = np.ones(len(arr), dtype=bool)
+        if 'when' in arr.dtype.names:
+            when = arr['when'].astype(np.int64)
+            keep &= when >= sync_release_time(arr['pid'], at)
+        if check_params:
+            keep &= param_pos[arr['pid']] < at
+        return arr[keep], at[keep]
+
+    for pid, count in zip(*np.unique(columns[3]['pid'], return_counts=True)):
+        task_dict[pid].jobs += count
+
+    for pid in task_dict:
+        task_dict[pid].misses.sync_release_time =\
+            task_dict[pid].preemptions.sync_release_time =\
+            sync_release_time(np.array([pid]), np.array([never]))[0]
+
+    releases, release_pos = synced(3, True)
+    completions, completion_pos = synced(7, False)
+    matched = match_times(
+        (releases['pid'], releases['job'], releases['deadline'], release_pos),
+        (completions['pid'], completions['job'], completions['when'],
+         completion_pos), True)
+    add_matches(task_dict, 'misses', *matched[:4])
+    if windows:
+        windows.add_releases(releases['when'])
+        windows.add_completions(releases['when'][matched[4]],
+                                np.maximum(matched[2], 0))
+
+    blocks, resumes = columns[8], columns[9]
+    matched = match_times(
+        (blocks['pid'], blocks['job'], blocks['when'], positions[8]),
+        (resumes['pid'], resumes['job'], resumes['when'], positions[9]), True)
+    add_matches(task_dict, 'blocks', *matched[:4])
+    if windows:
+        windows.add_blocks(blocks['when'][matched[4]], matched[2])
+
+    switch_to, to_pos = synced(5, True)
+    switch_away, away_pos = synced(6, True)
+    switches = np.concatenate((switch_to, switch_away.view(switch_to.dtype)))
+    del switch_to, switch_away
+    # Ordered by pid, as count_switches would, without another copy
+    switches = switches[np.lexsort((np.concatenate((to_pos, away_pos)),
+                                    switches['pid']))]
+    for counts in zip(*count_switches(switches)):
+        task_dict[counts[0]].preemptions.add_counts(*counts[1:])
+    if windows:
+        switches, preempted, _, migrated = find_preemptions(switches)
+        windows.add_preemptions(switches['when'][1:][preempted],
+                                migrated[preempted])
+
+    for type_num, batch in record_handlers.iteritems():
+        batch(task_dict, *synced(type_num, True))
+
+def job_keys(pids, jobs):
+    '''One uint64 per record identifying its (pid, job).'''
+    return jobs.astype(np.uint64) << np.uint64(16) | pids.astype(np.uint64)
+
+def make_job_table(columns, positions):
+    '''Return a map of column names to arrays with one row per released
+    job in sorted @columns. Times are in ns, and -1 where a job has no
+    completion record. Block times, preemptions and migrations are counted
+    over all of a job's records.'''
+    releases = columns[3]
+    keys, first = np.unique(job_keys(releases['pid'], releases['job']),
+                            return_index=True)
+    releases = releases[first]
+
+    def rows(arr_keys):
+        '''Row of each of @arr_keys, or -1 if the job was never released.'''
+        if not len(keys):
+            return np.repeat(-1, len(arr_keys))
+        at = np.searchsorted(keys, arr_keys).clip(0, len(keys) - 1)
+        return np.where(keys[at] == arr_keys, at, -1)
+
+    def per_row(arr_keys, weights = None):
+        at = rows(arr_keys)
+        found = at >= 0
+        if weights is not None:
+            weights = weights[found]
+        return np.bincount(at[found], weights, minlength=len(keys))
+
+    release  = releases['when'].astype(np.int64)
+    deadline = releases['deadline'].astype(np.int64)
+
+    # Only a job's first completion counts
+    completions = columns[7]
+    ckeys, cfirst = np.unique(job_keys(completions['pid'], completions['job']),
+                              return_index=True)
+    completion = np.repeat(np.int64(-1), len(keys))
+    at = rows(ckeys)
+    completion[at[at >= 0]] = completions['when'][cfirst][at >= 0]
+    done = completion >= 0
+
+    blocks, resumes = columns[8], columns[9]
+    pids, jobs, durations, _ = match_times(
+        (blocks['pid'], blocks['job'], blocks['when'], positions[8]),
+        (resumes['pid'], resumes['job'], resumes['when'], positions[9]))
+    block = per_row(job_keys(pids, jobs), np.maximum(durations, 0))
+
+    switches = np.concatenate((columns[5], columns[6].view(columns[5].dtype)))
+    order = np.argsort(np.concatenate((positions[5], positions[6])))
+    switches, preempted, _, migrated = find_preemptions(switches[order])
+    switch_keys = job_keys(switches['pid'], switches['job'])[1:]
+
+    return {'pid'        : releases['pid'],
+            'job'        : releases['job'],
+            'release'    : release,
+            'deadline'   : deadline,
+            'completion' : completion,
+            'response'   : np.where(done, completion - release, -1),
+            'tardiness'  : np.where(done, (completion - deadline).clip(0), -1),
+            'block'      : block.astype(np.int64),
+            'preemptions': per_row(switch_keys[preempted]).astype(np.int32),
+            'migrations' : per_row(switch_keys[migrated]).astype(np.int32)}
+
+def load_job_table(work_dir):
+    '''Return the per-job table stored in @work_dir by extract_sched_data,
+    as a map of column names to arrays.'''
+    with np.load("%s/%s" % (work_dir, JOB_TABLE_NAME)) as data:
+        return dict((name, data[name]) for name in data.files)
+
+def write_windows(windows, out_dir):
+    '''Write the stats of WindowTracker @windows as [stat]/time/line.csv
+    files in @out_dir.'''
+    dir_map = DirMap()
+    for stat, values in windows.stats().iteritems():
+        if values:
+            dir_map.add_values([stat, "time", "line.csv"], values)
+
+    if os.path.exists(out_dir):
+        sh.rmtree(out_dir)
+    if not dir_map.is_empty():
+        dir_map.write(out_dir)
+
+def add_matches(task_dict, tracker, pids, jobs, durations, unmatched):
+    '''Store the results of match_times in the @tracker of each task.'''
+    lost = defaultdict(int)
+    for pid, count in zip(*np.unique(unmatched, return_counts=True)):
+        lost[pid] = count
+    for pid, durs in split_by_pid(pids, durations):
+        getattr(task_dict[pid], tracker).add_matches(durs, lost.pop(pid, 0))
+    for pid, count in lost.iteritems():
+        getattr(task_dict[pid], tracker).add_matches(durations[:0], count)
+
+def start_st_show(data_dir, bin_names, output_file):
+    '''Write an in-english version of @bin_names into @output_file in the
+    background, unless it is already newer than all of them. Returns what
+    to pass to finish_st_show, or None.'''
+    bin_paths = ["%s/%s" % (data_dir, f) for f in bin_names]
+    if os.path.exists(output_file):
+        newest = max(os.path.getmtime(f) for f in bin_paths)
+        if os.path.getmtime(output_file) >= newest:
+            return None
+
+    cmd_arr = [conf.BINS['st_show']]
+    cmd_arr.extend(bin_names)
+
+    # Written under another name until st_show succeeds, so that an
+    # interrupted dump is not mistaken for an up-to-date one
+    out = open(output_file + ".tmp", "w")
+    proc = subprocess.Popen(cmd_arr, cwd=data_dir, stdout=out)
+    out.close()
+    return (proc, output_file)
+
+def finish_st_show(show, abort = False):
+    proc, output_file = show
+    if abort:
+        proc.kill()
+    if proc.wait() == 0:
+        os.rename(output_file + ".tmp", output_file)
+    else:
+        os.remove(output_file + ".tmp")
+
+def create_task_dict(data_dir, work_dir = None, procs = 1, st_show = False):
     '''Parse sched trace files'''
     bin_files   = conf.FILES['sched_data'].format(".*")
     output_file = "%s/out-st" % work_dir
 
+    # Per-window statistics are summed over all tasks as they are parsed
+    windows = None
+    if work_dir and conf.SCHED_WINDOW_MS:
+        windows = WindowTracker(int(conf.SCHED_WINDOW_MS * NSEC_PER_MSEC))
+
+    def add_block(start, end):
+        windows.add_block(start[1], end[1] - start[1])
+    def add_completion(start, end):
+        windows.add_completion(start[0].when, max(end[1] - start[1], 0))
+
     task_dict = defaultdict(lambda :
                             TaskData(None, 1,
-                                TimeTracker(is_valid_duration = lambda x: x > 0),
-                                TimeTracker(capper = lambda x: max(x, 0)),
-                                EventTraker()))
+                                TimeTracker(is_valid_duration = lambda x: x > 0,
+                                            on_match = windows and add_block),
+                                TimeTracker(capper = lambda x: np.maximum(x, 0),
+                                            on_match = windows and add_completion),
+                                EventTraker(on_preemption = windows and
+                                            windows.add_preemption),
+                                {}, windows))
 
     bin_names = [f for f in os.listdir(data_dir) if re.match(bin_files, f)]
     if not len(bin_names):
         return task_dict
 
-    # Save an in-english version of the data for debugging
-    # This is optional and will only be done if 'st_show' is in PATH
-    if conf.BINS['st_show']:
-        cmd_arr = [conf.BINS['st_show']]
-        cmd_arr.extend(bin_names)
-        with open(output_file, "w") as f:
-            subprocess.call(cmd_arr, cwd=data_dir, stdout=f)
+    # Save an in-english version of the data for debugging, while the
+    # data is parsed. This is optional and will only be done if asked for
+    # and 'st_show' is in PATH
+    show = None
+    if st_show and conf.BINS['st_show'] and work_dir:
+        show = start_st_show(data_dir, bin_names, output_file)
 
     # Gather per-task values
     bin_paths = ["%s/%s" % (data_dir,f) for f in bin_names]
-    read_data(task_dict, bin_paths)
+    try:
+        read_data(task_dict, bin_paths, work_dir, procs)
+    except:
+        if show:
+            finish_st_show(show, abort=True)
+        raise
+
+    if show:
+        finish_st_show(show)
+
+    if windows:
+        write_windows(windows, "%s/%s" % (work_dir, WINDOW_DIR_NAME))
 
     return task_dict
 
@@ -374,10 +1420,19 @@ SKIP_MSG = """Measurement '%s' has no non-zero values.
 Measurements like these are not included in scheduling statistics.
 If a measurement is missing, this is why."""
 
-def extract_sched_data(result, data_dir, work_dir):
-    task_dict = create_task_dict(data_dir, work_dir)
+def extract_sched_data(result, data_dir, work_dir, procs = 1, st_show = False):
+    task_dict = create_task_dict(data_dir, work_dir, procs, st_show)
     stat_data = defaultdict(list)
 
+    # Distributions of tardiness and blocking times over all jobs
+    sketches  = defaultdict(QuantileSketch)
+
+    # Values stored by record handlers. A task with no records of the
+    # event counts as 0, rather than being left out
+    extra_names = set()
+    for tdata in task_dict.itervalues():
+        extra_names.update(tdata.extra)
+
     # Group per-task values
     for tdata in task_dict.itervalues():
         if not tdata.params:
@@ -406,6 +1461,10 @@ def extract_sched_data(result, data_dir, work_dir):
 
         stat_data["block-avg"].append(tdata.blocks.avg / NSEC_PER_MSEC)
         stat_data["block-max"].append(tdata.blocks.max / NSEC_PER_MSEC)
+
+        if miss.sketch is not None:
+            sketches["tard-dist"].merge(miss.sketch)
+            sketches["block-dist"].merge(tdata.blocks.sketch)
         
         preemptions = tdata.preemptions.get_preemptions()
         filtered_preemptions = tdata.preemptions.get_filtered_preemptions()
@@ -419,9 +1478,154 @@ def extract_sched_data(result, data_dir, work_dir):
         stat_data["migrations-per-job"].append(float(migrations)/jobs)
         stat_data["filtered-preemptions-per-job"].append(float(filtered_preemptions)/jobs)        
 
+        for name in extra_names:
+            stat_data[name].append(tdata.extra.get(name, 0))
+
     # Summarize value groups
     for name, data in stat_data.iteritems():
         if not data:
             log_once(SKIP_MSG, SKIP_MSG % name)
             continue
         result[name] = Measurement(str(name)).from_array(data)
+
+    for name, sketch in sketches.iteritems():
+        if not len(sketch):
+            log_once(SKIP_MSG, SKIP_MSG % name)
+            continue
+        result[name] = Measurement(name).from_sketch(sketch, 1.0 / NSEC_PER_MSEC)
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of
+# freedom. Only a few slots are sampled, so the normal quantile (1.96)
+# would give intervals much too narrow
+CI_T = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+        7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179,
+        13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101,
+        19: 2.093, 20: 2.086, 25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000,
+        120: 1.980}
+
+def ci_quantile(df):
+    '''Quantile of CI_T for @df degrees of freedom, rounding @df down to
+    the nearest listed so that intervals are never too narrow.'''
+    return CI_T[max(d for d in CI_T if d <= df)]
+
+def sample_ranges(records, times, step, starts, width):
+    '''Return sorted, disjoint (start, end) ranges of @records holding the
+    first @step records and those timed within @width ns after any of
+    @starts. @times are the running maximum times of every @step-th
+    record, so ranges are widened by @step to catch records out of order.'''
+    ranges  = [(0, step)]
+    begins  = np.searchsorted(times, starts, 'left') - 1
+    ends    = np.searchsorted(times, starts + width, 'right') + 1
+    ranges += zip((begins.clip(0) * step).tolist(), (ends * step).tolist())
+
+    merged = []
+    for lo, hi in sorted(ranges):
+        hi = min(hi, len(records))
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        elif lo < hi:
+            merged += [(lo, hi)]
+    return merged
+
+def read_sample_columns(fnames, fraction):
+    '''Decode the head and @fraction of the time slots of each of @fnames
+    from their memory maps. Returns sorted columns, positions, the start
+    time and width of slots, and the indices of the slots read.'''
+    step = conf.SCHED_SAMPLE_STEP
+    records, times = [], []
+    for fname in fnames:
+        recs = map_records(fname)
+        keep, when = record_times(recs[::step])
+        records += [recs]
+        times   += [np.maximum.accumulate(np.where(keep, when, 0))]
+
+    first = [t[t > 0][0] for t in times if (t > 0).any()]
+    if not first:
+        return None
+    start = min(first)
+    end   = max(t[-1] for t in times if len(t)) + 1
+
+    slots = conf.SCHED_SAMPLE_SLOTS
+    width = (end - start) // slots + 1
+    count = min(slots, max(2, int(round(slots * fraction))))
+    picked = np.sort(np.random.choice(slots, count, replace=False))
+
+    # Read on past the end of slots so that their jobs can complete
+    margin = conf.SCHED_SAMPLE_MARGIN_MS * NSEC_PER_MSEC
+    starts = start + picked * width
+
+    column_maps = []
+    for recs, when in zip(records, times):
+        for lo, hi in sample_ranges(recs, when, step, starts, width + margin):
+            column_maps += [split_records(recs[lo:hi])]
+    columns, positions = sort_columns(concat_columns(column_maps))
+    return columns, positions, start, width, picked
+
+def extract_sched_sample(result, data_dir, work_dir, fraction):
+    '''Estimate sched_trace statistics of the experiment in @data_dir from
+    the jobs released in a random @fraction of its time slots, and store
+    them in @result along with 95% confidence intervals ("[stat]-ci") of
+    their averages over tasks. Only a part of each trace file is read.'''
+    bin_files = conf.FILES['sched_data'].format(".*")
+    bin_paths = ["%s/%s" % (data_dir, f) for f in os.listdir(data_dir)
+                 if re.match(bin_files, f)]
+    sample = read_sample_columns(bin_paths, fraction) if bin_paths else None
+    if not sample:
+        return
+    columns, positions, start, width, picked = sample
+
+    table = make_job_table(columns, positions)
+    slot  = (table['release'] - start) // width
+    keep  = np.in1d(slot, picked) & (table['completion'] >= 0)
+
+    # Only tasks whose parameters were recorded are measured
+    params  = columns[2]
+    periods = dict(zip(params['pid'].tolist(), params['period'].tolist()))
+    keep   &= np.in1d(table['pid'], periods.keys())
+    if not keep.any():
+        return
+
+    pids   = table['pid'][keep]
+    period = np.array([periods[pid] for pid in pids.tolist()], dtype=float)
+    tard   = table['tardiness'][keep] / period
+
+    job_values = {"miss-ratio"         : tard > 0,
+                  "tard-avg"           : tard,
+                  "preemptions-per-job": table['preemptions'][keep],
+                  "migrations-per-job" : table['migrations'][keep]}
+
+    _, task = np.unique(pids, return_inverse=True)
+
+    # The largest sampled tardiness only bounds the true one from below,
+    # so it is reported without an interval
+    tard_max = np.zeros(task.max() + 1)
+    np.maximum.at(tard_max, task, tard)
+    result["tard-max"] = Measurement("tard-max").from_array(tard_max)
+
+    # Group jobs by task within each slot
+    _, cell = np.unique(slot[keep] * (task.max() + 1) + task,
+                        return_inverse=True)
+    cell_slot = np.zeros(cell.max() + 1, dtype=np.int64)
+    cell_slot[cell] = slot[keep]
+    _, in_slot = np.unique(cell_slot, return_inverse=True)
+
+    def per_group(group, values):
+        return np.bincount(group, values) / np.bincount(group)
+
+    for name, values in job_values.iteritems():
+        per_task = per_group(task, values)
+        result[name] = Measurement(name).from_array(per_task)
+
+        # Spread of the task average between slots, the sampled units
+        per_cell = per_group(cell, values)
+        per_slot = np.bincount(in_slot, per_cell) / np.bincount(in_slot)
+        if len(per_slot) < 2:
+            continue
+
+        finite = 1 - float(len(per_slot)) / conf.SCHED_SAMPLE_SLOTS
+        error  = per_slot.std(ddof=1) / np.sqrt(len(per_slot)) * np.sqrt(finite)
+        error *= ci_quantile(len(per_slot) - 1)
+        avg    = per_task.mean()
+        # Avg is the estimate, Min and Max the bounds of its interval
+        result["%s-ci" % name] = Measurement("%s-ci" % name).from_array(
+            [avg - error, avg + error])
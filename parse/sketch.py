@@ -0,0 +1,103 @@
+import config.config as conf
+import math
+import numpy as np
+
+from collections import defaultdict
+
+class QuantileSketch(object):
+    '''Mergeable log-histogram (DDSketch) of durations. Quantiles are within
+    @relative_accuracy of the true value, while the count, sum, min, max,
+    mean and variance are exact. Memory depends only on the range of the
+    values, not on how many there are.'''
+    def __init__(self, relative_accuracy = None):
+        self.accuracy  = relative_accuracy or conf.SKETCH_ACCURACY
+        self.gamma     = (1 + self.accuracy) / (1 - self.accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        # Values <= 0 have no logarithm and are counted separately
+        self.bins  = defaultdict(int)
+        self.zeros = 0
+
+        self.count = 0
+        self.sum   = 0
+        self.min   = float('inf')
+        self.max   = float('-inf')
+        self.mean  = 0.0
+        self.m2    = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def __combine(self, count, total, mean, m2, low, high):
+        '''Merge moments of another set of values (Chan et al.).'''
+        new_count = self.count + count
+        delta = mean - self.mean
+        self.m2   += m2 + delta * delta * self.count * count / new_count
+        self.mean += delta * count / new_count
+        self.count = new_count
+        self.sum  += total
+        self.min   = min(self.min, low)
+        self.max   = max(self.max, high)
+
+    def add(self, value):
+        if value > 0:
+            self.bins[int(math.ceil(math.log(value) / self.log_gamma))] += 1
+        else:
+            self.zeros += 1
+        self.__combine(1, value, float(value), 0.0, value, value)
+
+    def add_array(self, values):
+        values = np.asarray(values)
+        if not len(values):
+            return
+
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        if len(positive):
+            index = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+            for i, n in zip(*np.unique(index, return_counts=True)):
+                self.bins[int(i)] += int(n)
+
+        mean = values.mean(dtype=np.float64)
+        m2   = np.square(values - mean).sum()
+        self.__combine(len(values), values.sum(), mean, m2,
+                       values.min(), values.max())
+
+    def merge(self, other):
+        '''Add all values of @other, which must have the same accuracy.'''
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches of different accuracy")
+        if not other.count:
+            return self
+        for i, n in other.bins.iteritems():
+            self.bins[i] += n
+        self.zeros += other.zeros
+        self.__combine(other.count, other.sum, other.mean, other.m2,
+                       other.min, other.max)
+        return self
+
+    def var(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def std(self):
+        return math.sqrt(self.var())
+
+    def quantile(self, q):
+        '''Estimate the @q-quantile, 0 <= q <= 1.'''
+        if not self.count:
+            raise ValueError("Empty sketch")
+
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return self.min
+
+        seen = self.zeros
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if seen > rank:
+                break
+        value = 2 * self.gamma ** i / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def percentile(self, which):
+        return self.quantile(which / 100.0)
@@ -2,18 +2,26 @@
 from __future__ import print_function
 
 import common as com
+import config.config as conf
+import hashlib
+import itertools
 import multiprocessing
 import os
 import parse.ft as ft
 import parse.sched as st
 import pickle
+import pprint
+import re
 import shutil as sh
 import sys
+import time
 import traceback
 
 from collections import namedtuple
 from config.config import FILES,DEFAULTS,PARAMS
 from optparse import OptionParser
+from parse.cache import clean_work_dir,dir_key,is_cached,mark_cached
+from parse.exp_db import ExpDB
 from parse.point import ExpPoint
 from parse.tuple_table import TupleTable
 from parse.col_map import ColMapBuilder
@@ -28,7 +36,8 @@ def parse_args():
     parser.add_option('-i', '--ignore', metavar='[PARAM...]', default="",
                       help='ignore changing parameter values')
     parser.add_option('-f', '--force', action='store_true', default=False,
-                      dest='force', help='overwrite existing data')
+                      dest='force', help=('overwrite existing data, even ' +
+                                          'if its inputs did not change'))
     parser.add_option('-v', '--verbose', action='store_true', default=False,
                       dest='verbose', help='print out data points')
     parser.add_option('-m', '--write-map', action='store_true', default=False,
@@ -38,6 +47,26 @@ def parse_args():
                       default=max(multiprocessing.cpu_count() - 1, 1),
                       type='int', dest='processors',
                       help='number of threads for processing')
+    parser.add_option('-s', '--st-show', dest='st_show', action='store_true',
+                      default=False,
+                      help=('also write sched_trace data as text into ' +
+                            'tmp/out-st using st_show (slow)'))
+    parser.add_option('-q', '--quick', dest='sample', type='float',
+                      default=0, metavar='FRACTION',
+                      help=('estimate sched_trace statistics from a random '
+                            'FRACTION of each experiment, with confidence '
+                            'intervals, skipping overheads'))
+    parser.add_option('-d', '--db', dest='db', default=None,
+                      help=('also index parsed experiments in this SQLite ' +
+                            'database, updating only those which changed'))
+    parser.add_option('--from-db', dest='from_db', action='store_true',
+                      default=False,
+                      help=('read experiments in or below data_dirs (or all) ' +
+                            'from the --db database instead of parsing them'))
+    parser.add_option('--costs', dest='costs', default=None, metavar='FILE',
+                      help=('write the estimated and actual seconds spent ' +
+                            'parsing each experiment into csv FILE, to ' +
+                            'tune the PARSE_COST settings'))
     parser.add_option('-c', '--collapse', dest='collapse',
                       action='store_true', default=False,
                       help=('simplify graphs where possible by averaging ' +
@@ -47,25 +76,48 @@ def parse_args():
 
 
 ExpData = namedtuple('ExpData', ['path', 'params', 'work_dir'])
+ParseOpts = namedtuple('ParseOpts', ['force', 'procs', 'st_show', 'sample'])
 
 
-def parse_exp(exp_force):
-    # Tupled for multiprocessing
-    exp, force = exp_force
+def result_key(exp, opts):
+    '''Return the manifest of everything the result of @exp depends on:
+    its input files and the PARSE_SETTINGS it is parsed with.'''
+    settings = [(name, getattr(conf, name)) for name in conf.PARSE_SETTINGS]
+    settings += [('sample', opts.sample)]
+    # Dicts are sorted when formatted, so equal settings print the same
+    fingerprint = hashlib.sha1(pprint.pformat(settings)).hexdigest()
+    return "%s\nsettings %s\n" % (dir_key(exp.path), fingerprint)
+
 
-    result_file = exp.work_dir + "/exp_point.pkl"
-    should_load = not force and os.path.exists(result_file)
+def parse_exp(exp_opts):
+    # Tupled for multiprocessing
+    exp, opts = exp_opts
 
-    result = None
+    # Estimates are kept apart so they are never mistaken for full results
+    if opts.sample:
+        result_file = exp.work_dir + "/exp_point-quick.pkl"
+    else:
+        result_file = exp.work_dir + "/exp_point.pkl"
+    key = result_key(exp, opts)
+    # Results are reused only if nothing they were parsed from changed
+    should_load = not opts.force and is_cached(result_file, key)
+
+    result   = None
+    elapsed  = None
+    # Whether result holds everything, rather than what was parsed
+    # before a failure
+    complete = False
     if should_load:
         with open(result_file, 'rb') as f:
             try:
                 # No need to go through this work twice
                 result = pickle.load(f)
+                complete = True
             except:
                 pass
 
     if not result:
+        start = time.time()
         try:
             # Create a readable name
             name = os.path.relpath(exp.path)
@@ -73,19 +125,29 @@ def parse_exp(exp_force):
 
             result = ExpPoint(name)
 
-            # Write overheads into result
-            cycles = exp.params[PARAMS['cycles']]
-            ft.extract_ft_data(result, exp.path, exp.work_dir, cycles)
+            if opts.sample:
+                result.approximate = True
+                st.extract_sched_sample(result, exp.path, exp.work_dir,
+                                        opts.sample)
+            else:
+                # Write overheads into result
+                cycles = exp.params[PARAMS['cycles']]
+                ft.extract_ft_data(result, exp.path, exp.work_dir, cycles,
+                                   opts.procs)
 
-            # Write scheduling statistics into result
-            st.extract_sched_data(result, exp.path, exp.work_dir)
+                # Write scheduling statistics into result
+                st.extract_sched_data(result, exp.path, exp.work_dir,
+                                      opts.procs, opts.st_show)
 
             with open(result_file, 'wb') as f:
                 pickle.dump(result, f)
+            mark_cached(result_file, key)
+            complete = True
         except:
             traceback.print_exc()
+        elapsed = time.time() - start
 
-    return (exp, result)
+    return (exp, result, key, elapsed, complete)
 
 
 def get_exp_params(data_dir, cm_builder):
@@ -119,8 +181,9 @@ def load_exps(exp_dirs, cm_builder, force):
         # Used to store error output and debugging info
         work_dir = data_dir + "/tmp"
 
+        # Cached trace data is kept, as it is only used if still valid
         if os.path.exists(work_dir) and force:
-            sh.rmtree(work_dir)
+            clean_work_dir(work_dir)
         if not os.path.exists(work_dir):
             os.mkdir(work_dir)
 
@@ -143,41 +206,127 @@ def get_dirs(args):
         return [os.getcwd()]
 
 
-def fill_table(table, exps, opts):
+def load_db_exps(db, dirs, cm_builder):
+    '''Return (ExpData, result) of experiments in @db below @dirs.'''
+    exps = []
+
+    sys.stderr.write("Loading experiments from database...\n")
+
+    for path, params, result in db.load(dirs or None):
+        for key, value in params.iteritems():
+            cm_builder.try_add(key, value)
+        exps += [(ExpData(path, params, None), result)]
+
+    return exps
+
+
+def trace_bytes(data_dir):
+    '''Return the total size of feather-trace and of sched_trace files in
+    @data_dir.'''
+    ft_reg = conf.FILES['ft_matches'] + "$"
+    st_reg = conf.FILES['sched_data'].format(".*") + "$"
+
+    ft_bytes, st_bytes = 0, 0
+    for name in os.listdir(data_dir):
+        if re.match(ft_reg, name):
+            ft_bytes += os.path.getsize("%s/%s" % (data_dir, name))
+        elif re.match(st_reg, name):
+            st_bytes += os.path.getsize("%s/%s" % (data_dir, name))
+    return ft_bytes, st_bytes
+
+
+def estimate_cost(ft_bytes, st_bytes, sample):
+    '''Return the estimated seconds to parse an experiment with @ft_bytes
+    and @st_bytes of trace data, or a @sample fraction of it.'''
+    if sample:
+        # Only sampled sched_trace data is read
+        return conf.PARSE_COST_BASE + sample * conf.PARSE_COST_ST * st_bytes
+    return (conf.PARSE_COST_BASE + conf.PARSE_COST_FT * ft_bytes +
+            conf.PARSE_COST_ST * st_bytes)
+
+
+def write_costs(fname, costs):
+    '''Write rows of (path, ft bytes, st bytes, estimated, actual seconds)
+    @costs into csv @fname, the worst estimates first.'''
+    costs = sorted(costs, key=lambda row: abs(row[4] - row[3]), reverse=True)
+
+    with open(fname, 'w') as f:
+        f.write("path,ft-bytes,st-bytes,estimate,actual\n")
+        for row in costs:
+            f.write("%s,%d,%d,%.3f,%.3f\n" % row)
+
+
+def fill_table(table, exps, opts, db = None):
     sys.stderr.write("Parsing data...\n")
 
-    procs  = min(len(exps), opts.processors)
-    logged = multiprocessing.Manager().list()
+    sizes = dict((exp.path, trace_bytes(exp.path)) for exp in exps)
+    estimates = dict((path, estimate_cost(ft_bytes, st_bytes, opts.sample))
+                     for path, (ft_bytes, st_bytes) in sizes.iteritems())
+
+    # Longest first, so the largest experiments are not left running
+    # alone at the end while every other worker is idle
+    exps = sorted(exps, key=lambda exp: estimates[exp.path], reverse=True)
+    costs = []
+
+    if len(exps) == 1:
+        # Pool workers cannot start processes of their own, so parse a
+        # single experiment here, decoding its trace files in parallel
+        pool = None
+        parse_opts = ParseOpts(opts.force, opts.processors, opts.st_show,
+                               opts.sample)
+        enum = itertools.imap(parse_exp, [(exps[0], parse_opts)])
+    else:
+        procs  = min(len(exps), opts.processors)
+        logger = com.LogListener()
 
-    pool = multiprocessing.Pool(processes=procs,
-    # Share a list of previously logged messages amongst processes
-    # This is for the com.log_once method to use
-                initializer=com.set_logged_list, initargs=(logged,))
+        # Workers send messages of com.log_once to be written here
+        pool = multiprocessing.Pool(processes=procs,
+                    initializer=com.set_log_queue, initargs=(logger.queue,))
 
-    pool_args = zip(exps, [opts.force]*len(exps))
-    enum = pool.imap_unordered(parse_exp, pool_args, 1)
+        parse_opts = ParseOpts(opts.force, 1, opts.st_show, opts.sample)
+        pool_args = zip(exps, [parse_opts]*len(exps))
+        enum = pool.imap_unordered(parse_exp, pool_args, 1)
 
     try:
-        for i, (exp, result) in enumerate(enum):
+        for i, (exp, result, key, elapsed, complete) in enumerate(enum):
+            # Results loaded from a previous run tell nothing about costs
+            if elapsed is not None:
+                costs += [(exp.path,) + sizes[exp.path] +
+                          (estimates[exp.path], elapsed)]
+
             if not result:
                 continue
 
+            # Estimates and partial results are never indexed. Fresh
+            # results replace whatever was indexed, loaded ones are only
+            # added if missing or outdated
+            if db and complete and not opts.sample and\
+               (elapsed is not None or db.get_key(exp.path) != key):
+                db.store(exp.path, exp.params, key, result)
+
             if opts.verbose:
                 print(result)
             else:
                 sys.stderr.write('\r {0:.2%}'.format(float(i)/len(exps)))
                 table[exp.params] += [result]
 
-        pool.close()
+        if pool:
+            pool.close()
     except:
-        pool.terminate()
+        if pool:
+            pool.terminate()
         traceback.print_exc()
         raise Exception("Failed parsing!")
     finally:
-        pool.join()
+        if pool:
+            pool.join()
+            logger.stop()
 
     sys.stderr.write('\n')
 
+    if opts.costs:
+        write_costs(opts.costs, costs)
+
 
 def write_csvs(table, out, print_empty=False):
     reduced_table = table.reduce()
@@ -257,11 +406,18 @@ def write_output(table, opts):
 
 def main():
     opts, args = parse_args()
-    exp_dirs = get_dirs(args)
+
+    if opts.from_db and not opts.db:
+        sys.stderr.write("--from-db needs a database (--db)\n")
+        sys.exit(1)
+    db = ExpDB(opts.db) if opts.db else None
 
     # Load experiment parameters into a ColMap
     builder = ColMapBuilder()
-    exps = load_exps(exp_dirs, builder, opts.force)
+    if opts.from_db:
+        exps = load_db_exps(db, args, builder)
+    else:
+        exps = load_exps(get_dirs(args), builder, opts.force)
 
     # Don't track changes in ignored parameters
     if opts.ignore:
@@ -276,7 +432,17 @@ def main():
     col_map = builder.build()
     table = TupleTable(col_map)
 
-    fill_table(table, exps, opts)
+    if opts.from_db:
+        for exp, result in exps:
+            if opts.verbose:
+                print(result)
+            else:
+                table[exp.params] += [result]
+    else:
+        fill_table(table, exps, opts, db)
+
+    if db:
+        db.close()
 
     if not table:
         sys.stderr.write("Found no data to parse!")
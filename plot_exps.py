@@ -140,10 +140,10 @@ def plot_dir(data_dir, out_dir, max_procs, force):
         return
 
     procs  = min(len(plot_details), max_procs)
-    logged = multiprocessing.Manager().list()
+    logger = com.LogListener()
 
     pool   = multiprocessing.Pool(processes=procs,
-                initializer=com.set_logged_list, initargs=(logged,))
+                initializer=com.set_log_queue, initargs=(logger.queue,))
 
     enum  = pool.imap_unordered(plot_wrapper, plot_details)
 
@@ -157,6 +157,7 @@ def plot_dir(data_dir, out_dir, max_procs, force):
         raise Exception("Failed plotting!")
     finally:
         pool.join()
+        logger.stop()
 
     sys.stderr.write('\n')
 